@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# Times chio's hot paths: challenge generation for the ops and depths that the levels use, pipe and socket partner
+# resolution with a given number of other processes (each holding a given number of pipes and sockets) on the host,
+# the process checks, and bare startup. The results are written as JSON, so that two commits can be compared with
+# --compare.
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+#pylint:disable=wrong-import-position
+import chio
+import startup_report
+
+CHALLENGE_OPS = [ "+*", "+*%", "+*&^%|" ]
+CHALLENGE_DEPTHS = [ 3, 5, 10 ]
+
+BINARY_SOURCE = "#include <unistd.h>\nint pwncollege() { return 0; }\nint main() { pause(); }\n"
+
+def time_calls(function, *args, runs, min_time):
+    # like timeit's autorange: each run makes enough calls to take at least min_time, and the per-call times are returned
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    times = [ elapsed / number ]
+    for _ in range(runs - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function(*args)
+        times.append((time.perf_counter() - start) / number)
+    return number, times
+
+def result(name, params, number, times):
+    return {
+        "name": name, "params": params, "number": number, "runs": len(times),
+        "median_us": round(statistics.median(times) * 1e6, 3), "min_us": round(min(times) * 1e6, 3),
+    }
+
+def spawn_load(num_processes, num_fds):
+    # forks processes that each hold num_fds pipes and num_fds sockets, and returns their pids once they all do
+    ready_r, ready_w = os.pipe()
+    pids = [ ]
+    for _ in range(num_processes):
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            held = [ os.pipe() for _ in range(num_fds) ] + [ socket.socketpair() for _ in range(num_fds) ]
+            os.write(ready_w, b"!")
+            while held:
+                signal.pause()
+        pids.append(pid)
+    os.close(ready_w)
+    for _ in range(num_processes):
+        os.read(ready_r, 1)
+    os.close(ready_r)
+    return pids
+
+def stop_processes(pids):
+    for pid in pids:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+def bench_challenges(args):
+    for ops in CHALLENGE_OPS:
+        for depth in CHALLENGE_DEPTHS:
+            number, times = time_calls(chio.generate_challenge, ops, depth, random.Random(0), runs=args.runs, min_time=args.min_time)
+            yield result("generate_challenge", { "ops": ops, "depth": depth }, number, times)
+
+def bench_partners(args, num_processes):
+    # the partners are started after the load, so that they have the highest pids and every scan goes through the load
+    load = spawn_load(num_processes, args.fds)
+    params = { "processes": num_processes, "fds": args.fds }
+    try:
+        pipe_r, pipe_w = os.pipe()
+        with subprocess.Popen([ "sleep", "1000" ], stdout=pipe_w) as pipe_partner:
+            os.close(pipe_w)
+            chio.SELF_FDS = chio.snapshot_fds()
+            number, times = time_calls(chio.resolve_fd_pipe_partner, os.getpid(), pipe_r, runs=args.runs, min_time=args.min_time)
+            assert chio.resolve_fd_pipe_partner(os.getpid(), pipe_r) == pipe_partner.pid
+            yield result("resolve_fd_pipe_partner", params, number, times)
+            pipe_partner.kill()
+        os.close(pipe_r)
+
+        with socket.create_server(("127.0.0.1", 0)) as server:
+            client_source = f"import signal, socket\ns = socket.create_connection(('127.0.0.1', {server.getsockname()[1]}))\nsignal.pause()"
+            with subprocess.Popen([ sys.executable, "-c", client_source ]) as client:
+                conn,_ = server.accept()
+                chio.SELF_FDS = chio.snapshot_fds()
+                number, times = time_calls(chio.resolve_fd_socket_partner, os.getpid(), conn.fileno(), runs=args.runs, min_time=args.min_time)
+                assert chio.resolve_fd_socket_partner(os.getpid(), conn.fileno()) == client.pid
+                yield result("resolve_fd_socket_partner", params, number, times)
+                conn.close()
+                client.kill()
+    finally:
+        stop_processes(load)
+
+def bench_process_checks(args):
+    with subprocess.Popen([ "sleep", "1000" ]) as sleeper:
+        process = chio.ProcessSnapshot(sleeper.pid)
+        number, times = time_calls(chio.check_exe_basename, process, "sleep", runs=args.runs, min_time=args.min_time)
+        yield result("check_exe_basename", { }, number, times)
+        sleeper.kill()
+
+    # check_binary only looks inside binaries in /home
+    if not shutil.which("gcc"):
+        print("Skipping check_binary: there is no gcc to build a binary with.", file=sys.stderr)
+        return
+    try:
+        binary_dir = tempfile.mkdtemp(dir="/home")
+    except OSError:
+        print("Skipping check_binary: we can't build a binary in /home.", file=sys.stderr)
+        return
+    try:
+        binary = os.path.join(binary_dir, "pwncollege")
+        subprocess.run([ "gcc", "-o", binary, "-x", "c", "-" ], input=BINARY_SOURCE.encode(), check=True)
+        with subprocess.Popen([ binary ]) as program:
+            process = chio.ProcessSnapshot(program.pid)
+            number, times = time_calls(chio.check_binary, process, runs=args.runs, min_time=args.min_time)
+            yield result("check_binary", { }, number, times)
+            program.kill()
+    finally:
+        shutil.rmtree(binary_dir)
+
+def bench_startup(args):
+    # a whole run of chio with no checks, from exec() to exit
+    results = [ startup_report.measure(chio.__file__, [ ], 0.5) for _ in range(args.runs) ]
+    record = result("startup", { }, 1, [ r[1] for r in results ])
+    record["first_output_median_us"] = round(statistics.median(r[0] for r in results) * 1e6, 3)
+    record["peak_rss_kb"] = max(r[2] for r in results)
+    yield record
+
+def current_commit():
+    try:
+        return subprocess.run(
+            [ "git", "rev-parse", "HEAD" ], cwd=os.path.dirname(chio.__file__), capture_output=True, check=True
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_report, new_report):
+    # prints the change in each benchmark's median, for the benchmarks that are in both reports
+    old_results = { (r["name"], json.dumps(r["params"], sort_keys=True)): r for r in old_report["results"] }
+    print(f"comparing {old_report['commit']} to {new_report['commit']}", file=sys.stderr)
+    for r in new_report["results"]:
+        old = old_results.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if old is None:
+            continue
+        change = (r["median_us"] - old["median_us"]) / old["median_us"] * 100
+        print(f"{change:+8.1f}%  {old['median_us']:12.3f} us -> {r['median_us']:12.3f} us  {r['name']} {json.dumps(r['params'])}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="how many timed runs to make of each benchmark")
+    parser.add_argument("--min_time", type=float, default=0.05, help="the minimum number of seconds that each timed run takes")
+    parser.add_argument("--processes", type=lambda s: [ int(n) for n in s.split(",") ], default=[ 0, 100 ], help="comma-separated numbers of other processes to resolve partners among")
+    parser.add_argument("--fds", type=int, default=16, help="how many pipes (and how many sockets) each of those processes holds")
+    parser.add_argument("--output", type=str, help="file to write the results to (default: stdout)")
+    parser.add_argument("--compare", type=str, help="results from an earlier run, to print the changes against")
+    args = parser.parse_args()
+
+    results = list(bench_challenges(args))
+    for num_processes in args.processes:
+        results += bench_partners(args, num_processes)
+    results += bench_process_checks(args)
+    results += bench_startup(args)
+
+    report = { "commit": current_commit(), "python": platform.python_version(), "time": int(time.time()), "results": results }
+    if args.output:
+        with open(args.output, "w") as f: #pylint:disable=unspecified-encoding
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f: #pylint:disable=unspecified-encoding
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
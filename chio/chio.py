@@ -1,21 +1,226 @@
 #!/usr/bin/python3 -I
 
-import argparse
-import asteval
+#
+# Startup partner snapshot. This runs before everything else (including the heavier imports), because the processes
+# on the other end of our stdio pipes can be fast-running (e.g., `cat some_file`) and gone by the time we check them.
+#
+
+import fcntl
 import os
-import psutil
-import random
-import re
-import shutil
 import signal
-import socket
 import stat
-import subprocess
 import sys
 import time
 
-SELF = psutil.Process(os.getpid())
-PARENT = SELF.parent()
+# pidfds are moved out of the way of low fds that a level might expect students to pass in
+PIDFD_MIN_FD = 256
+
+# (wall clock, cpu time) when we started running, for the startup entry of the --chio_profile report
+_started = (time.perf_counter(), time.process_time())
+def profiling_requested(argv):
+    return any(a.startswith("--chio_profile") for a in argv)
+# { counter: count } of the work done so far, when profiling. this is decided before the arguments are parsed, so
+# that the startup snapshot below gets counted too.
+_profile_counts = { } if profiling_requested(sys.argv) else None
+def count(counter, n=1):
+    if _profile_counts is not None:
+        _profile_counts[counter] = _profile_counts.get(counter, 0) + n
+
+def read_proc_link(pid, name):
+    count("proc_reads")
+    try:
+        return os.readlink(f"/proc/{pid}/{name}")
+    except OSError:
+        return ""
+
+def read_proc_stat(pid):
+    # returns (state, ppid)
+    count("proc_reads")
+    try:
+        with open(f"/proc/{pid}/stat") as f: #pylint:disable=unspecified-encoding
+            fields = f.read().rsplit(")", 1)[1].split()
+        return fields[0], int(fields[1])
+    except (OSError, IndexError, ValueError):
+        return "?", 0
+
+def read_proc_cmdline(pid):
+    # split the same way psutil does, including for processes that rewrote their cmdline with spaces
+    count("proc_reads")
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            data = f.read().decode(errors="replace")
+    except OSError:
+        return [ ]
+    if not data:
+        return [ ]
+    sep = "\0" if data.endswith("\0") else " "
+    cmdline = data[:-1].split(sep) if data.endswith(sep) else data.split(sep)
+    if sep == "\0" and len(cmdline) == 1 and " " in data:
+        cmdline = data.split(" ")
+    return cmdline
+
+def pin_process(pid):
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+    try:
+        return fcntl.fcntl(pidfd, fcntl.F_DUPFD_CLOEXEC, PIDFD_MIN_FD)
+    except OSError:
+        return None
+    finally:
+        os.close(pidfd)
+
+class ProcessSnapshot:
+    # everything the checks look at in a process, read from /proc exactly once
+    __slots__ = [ "pid", "ppid", "state", "pidfd", "_exe", "_cmdline", "_cwd" ]
+
+    def __init__(self, pid, pin=False):
+        self.pid = pid
+        self.pidfd = pin_process(pid) if pin else None
+        self.state, self.ppid = read_proc_stat(pid)
+        self._exe = read_proc_link(pid, "exe")
+        self._cmdline = read_proc_cmdline(pid)
+        self._cwd = read_proc_link(pid, "cwd")
+
+    def exe(self):
+        return self._exe
+    def cmdline(self):
+        return self._cmdline
+    def cwd(self):
+        return self._cwd
+
+    def is_running(self):
+        if self.pidfd is not None:
+            try:
+                signal.pidfd_send_signal(self.pidfd, 0)
+            except ProcessLookupError:
+                return False
+            except (AttributeError, PermissionError):
+                pass
+        return read_proc_stat(self.pid)[0] not in ("Z", "?")
+
+def is_unexeced_fork(pid):
+    # a process that was just fork()ed to run our partner still looks exactly like its parent until it execve()s
+    _, ppid = read_proc_stat(pid)
+    if not ppid:
+        return False
+    return read_proc_cmdline(pid) == read_proc_cmdline(ppid) and read_proc_link(pid, "exe") == read_proc_link(ppid, "exe")
+
+class FdInfo:
+    # what one of our own fds refers to, identified by (st_dev, st_ino) rather than by path
+    __slots__ = [ "kind", "dev", "ino", "link" ]
+
+    def __init__(self, fd):
+        st = os.fstat(fd)
+        self.dev, self.ino = st.st_dev, st.st_ino
+        self.link = read_proc_link("self", f"fd/{fd}")
+        if stat.S_ISFIFO(st.st_mode):
+            self.kind = "pipe" if self.link.startswith("pipe:") else "fifo"
+        elif stat.S_ISSOCK(st.st_mode):
+            self.kind = "socket"
+        elif os.isatty(fd):
+            self.kind = "tty"
+        elif st.st_nlink == 0:
+            self.kind = "deleted"
+        else:
+            self.kind = "file"
+
+def snapshot_fds():
+    count("proc_reads")
+    fds = { }
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            fds[int(fd)] = FdInfo(int(fd))
+        except OSError:
+            # this is the fd that listdir() used
+            pass
+    return fds
+
+def snapshot_stdio_partners():
+    # returns { fd: [ snapshots of the other processes holding that pipe, in pid order ] } for stdio pipes
+    our_pipes = { fd: read_proc_link("self", f"fd/{fd}") for fd in (0, 1, 2) }
+    holders = { pipe: [ ] for pipe in our_pipes.values() if pipe.startswith("pipe:") }
+
+    # as in resolve_pipe_partners(), once a non-parent process holds the pipe, later ones can't change any answer
+    remaining = set(holders)
+    count("proc_reads")
+    for other in sorted(int(p) for p in os.listdir("/proc") if p.isdigit()):
+        if not remaining:
+            break
+        if other == os.getpid():
+            continue
+        count("proc_reads")
+        try:
+            other_fds = os.listdir(f"/proc/{other}/fd")
+        except OSError:
+            continue
+        for their_pipe in { read_proc_link(other, f"fd/{ofd}") for ofd in other_fds } & remaining:
+            holders[their_pipe].append(ProcessSnapshot(other, pin=True))
+            if other != os.getppid():
+                remaining.discard(their_pipe)
+
+    return { fd: holders[pipe] for fd,pipe in our_pipes.items() if pipe in holders }
+
+# this is taken before anything else opens fds of its own, and is kept up to date by setup_input()
+SELF_FDS = snapshot_fds()
+
+STDIO_PARTNER_ARGS = [ "--check_stdin_pipe", "--check_stdout_pipe", "--check_stderr_pipe", "--check_stdin_parent", "--check_stdout_parent" ]
+def wants_startup_partners(argv):
+    # this runs before the arguments are parsed, so it errs on the side of taking the snapshot. argparse also takes
+    # --flag=value and abbreviated flags, and a --chio_level's flags come from the level manifest, which we don't read
+    # this early.
+    for a in argv:
+        if a == "--":
+            return False
+        flag = a.split("=", 1)[0]
+        if len(flag) > 2 and flag.startswith("--") and any(f.startswith(flag) for f in STDIO_PARTNER_ARGS + [ "--chio_level" ]):
+            return True
+    return False
+STARTUP_PARTNERS = snapshot_stdio_partners() if wants_startup_partners(sys.argv[1:]) else { }
+
+#pylint:disable=wrong-import-position,wrong-import-order
+import argparse
+import atexit
+import errno
+import functools
+import importlib
+import operator
+import random
+import re
+import selectors
+import struct
+import threading
+
+class LazyModule:
+    # imported on first use, so that levels that never need a module don't pay for importing it
+    __slots__ = [ "_name", "_module" ]
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+ast = LazyModule("ast")
+hashlib = LazyModule("hashlib")
+json = LazyModule("json")
+mmap = LazyModule("mmap")
+shutil = LazyModule("shutil")
+socket = LazyModule("socket")
+subprocess = LazyModule("subprocess")
+py_compile = LazyModule("py_compile")
+tempfile = LazyModule("tempfile")
+zipapp = LazyModule("zipapp")
+
+# the process being checked: ourselves, or a launcher's process when running as a service (see serve())
+SELF_PID = os.getpid()
+PARENT_PID = read_proc_stat(SELF_PID)[1]
+# processes that hold copies of the checked process's fds, and so are never anyone's partner
+CHECKER_PIDS = { SELF_PID }
 
 #
 # Output
@@ -23,21 +228,63 @@ PARENT = SELF.parent()
 
 _args = None
 _last_type = None
-_open_files = { 0: sys.stdin, 1: sys.stdout, 2: sys.stderr}
+# (fd, text) pairs that haven't been written yet. they are written out, one write() per run of messages to the same fd,
+# right before we wait on the user, fork, or exit.
+_pending_output = [ ]
+# (the args it is for, { message type: fd }, format), so that the args are looked at once rather than for every message
+_output_config = None
+# checks running in the background buffer their messages here, so that do_checks() can print them in order
+_captured = threading.local()
 def print_msg(mtype, *msgs):
     #pylint:disable=global-statement
-    global _last_type
+    global _last_type, _output_config
+
+    if getattr(_captured, "messages", None) is not None:
+        _captured.messages.append((mtype, msgs))
+        return
 
-    fd = getattr(_args, f"chio_{mtype}_fd", -1) #pyltint:disable=used-before-assignment
+    if _output_config is None or _output_config[0] is not _args:
+        _output_config = (_args, { }, getattr(_args, "chio_format", "text"))
+    _, fds, output_format = _output_config
+    if mtype not in fds:
+        fds[mtype] = getattr(_args, f"chio_{mtype}_fd", -1)
+    fd = fds[mtype]
     if fd == -1:
         return
-    if fd not in _open_files:
-        _open_files[fd] = os.fdopen(fd, "w")
-    f = _open_files[fd]
+
+    if output_format == "jsonl":
+        _pending_output.append((fd, json.dumps({ "type": mtype, "message": " ".join(str(m) for m in msgs) }) + "\n"))
+        return
     if _last_type and _last_type != mtype:
-        print("", file=f)
+        _pending_output.append((fd, "\n"))
     _last_type = mtype
-    print(f"[{mtype.upper()}]", *msgs, file=f, flush=True)
+    _pending_output.append((fd, " ".join([ f"[{mtype.upper()}]" ] + [ str(m) for m in msgs ]) + "\n"))
+
+def flush_output():
+    while _pending_output:
+        fd = _pending_output[0][0]
+        run = 0
+        while run < len(_pending_output) and _pending_output[run][0] == fd:
+            run += 1
+        data = "".join(text for _,text in _pending_output[:run]).encode(errors="backslashreplace")
+        del _pending_output[:run]
+        while data:
+            data = data[os.write(fd, data):]
+
+def flush_output_at_exit():
+    try:
+        flush_output()
+    except OSError:
+        # whoever we were talking to is gone
+        pass
+atexit.register(flush_output_at_exit)
+
+# atexit runs after the traceback of an uncaught exception is printed, so pending output is flushed before it instead
+_excepthook = sys.excepthook
+def flush_output_before_traceback(*exc_info):
+    flush_output_at_exit()
+    _excepthook(*exc_info)
+sys.excepthook = flush_output_before_traceback
 
 def print_info(*msgs):
     print_msg("info", *msgs)
@@ -56,15 +303,140 @@ def print_flag(*msgs):
 def print_hype(*msgs):
     print_msg("hype", *msgs)
 
+#
+# Profiling
+#
+
+class Profile:
+    # the wall clock time, cpu time, and outcome of each step of the attempt. these are reported along with the counts
+    # at exit (with --chio_profile), and make up the attempt's record (with --chio_stats).
+    __slots__ = [ "fd", "steps" ]
+
+    def __init__(self, fd):
+        self.fd = fd
+        # the interpreter's own startup isn't on the wall clock, but it is in the process's cpu time
+        self.steps = [ ("startup", time.perf_counter() - _started[0], time.process_time() - _started[1], "ok") ]
+
+    def measure(self, name, function, *args):
+        # cpu time is per-thread, because the non-interactive checks run in threads of their own
+        wall, cpu = time.perf_counter(), time.thread_time()
+        outcome = "error"
+        try:
+            result = function(*args)
+            outcome = "ok"
+            return result
+        except AssertionError:
+            outcome = "fail"
+            raise
+        except SessionTimeout:
+            outcome = "timeout"
+            raise
+        except SystemExit:
+            # e.g., a wrong signal, which ends the attempt right away
+            outcome = "exit"
+            raise
+        finally:
+            self.steps.append((name, time.perf_counter() - wall, time.thread_time() - cpu, outcome))
+
+    def report(self, output_format):
+        if self.fd == -1:
+            return
+        counts = _profile_counts or { }
+        if output_format == "jsonl":
+            steps = [
+                { "name": name, "wall_ms": round(wall*1000, 3), "cpu_ms": round(cpu*1000, 3), "outcome": outcome }
+                for name,wall,cpu,outcome in self.steps
+            ]
+            text = json.dumps({ "type": "profile", "steps": steps, "counts": counts }) + "\n"
+        else:
+            lines = [ f"{'step':<20} {'wall (ms)':>10} {'cpu (ms)':>10}  outcome" ]
+            lines += [ f"{name:<20} {wall*1000:10.2f} {cpu*1000:10.2f}  {outcome}" for name,wall,cpu,outcome in self.steps ]
+            lines += [ f"{counter}: {n}" for counter,n in sorted(counts.items()) ]
+            text = ("\n" if _last_type else "") + "".join(f"[PROFILE] {line}\n" for line in lines)
+        data = text.encode()
+        while data:
+            data = data[os.write(self.fd, data):]
+
+_profile = None
+def profiled(name, function, *args):
+    if _profile is None:
+        return function(*args)
+    return _profile.measure(name, function, *args)
+
+def report_profile():
+    #pylint:disable=global-statement
+    global _profile
+    if _profile is None:
+        return
+    profile, _profile = _profile, None
+    try:
+        flush_output()
+        profile.report(getattr(_args, "chio_format", "text"))
+    except OSError:
+        pass
+atexit.register(report_profile)
+
+#
+# Deadlines
+#
+
+class SessionTimeout(Exception):
+    pass
+
+# every blocking wait goes through here, so that abandoned attempts don't linger forever
+_session_deadline = None
+_selector = selectors.PollSelector() # unlike epoll, poll works on regular files
+def wait_deadline():
+    # the time at which a wait that starts now should give up, or None to wait forever
+    step_timeout = getattr(_args, "chio_step_timeout", None)
+    deadlines = [ d for d in (_session_deadline, step_timeout and time.monotonic() + step_timeout) if d ]
+    return min(deadlines) if deadlines else None
+
+def time_left(deadline):
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise SessionTimeout()
+    return left
+
+# when running as a service, this is a pidfd for the launcher: once it exits, there is nobody left to wait for
+_launcher_pidfd = None
+def wait_any_readable(fds, deadline):
+    # returns the fds that became readable
+    flush_output()
+    watched = fds if _launcher_pidfd is None else fds + [ _launcher_pidfd ]
+    for w in watched:
+        _selector.register(w, selectors.EVENT_READ)
+    try:
+        while True:
+            ready = [ key.fd for key,_ in _selector.select(time_left(deadline)) ]
+            if any(fd in ready for fd in fds):
+                return [ fd for fd in fds if fd in ready ]
+            if ready:
+                raise SessionTimeout()
+    finally:
+        for w in watched:
+            _selector.unregister(w)
+
+def wait_readable(fd, deadline):
+    wait_any_readable([ fd ], deadline)
+
 #
 # Checking processes.
 #
 
+@functools.lru_cache(maxsize=None)
+def resolve_exe_basename(exe):
+    path = shutil.which(exe)
+    return os.path.basename(os.path.realpath(path)) if path else os.path.basename(exe)
+
 def check_exe_basename(process, basename, basename_regex=None):
     if basename_regex is None:
         basename_regex = basename
-    print_info(f"The process' executable is {process.exe()}.")
-    if os.path.basename(process.exe()) == "docker-init":
+    exe = process.exe()
+    print_info(f"The process' executable is {exe}.")
+    if os.path.basename(exe) == "docker-init":
         print_warn("This process is the initialization process of your docker container (aka PID 1).")
         print_warn("When the parent of a process terminates, that process is 'reparented' to PID 1.")
         print_warn("So, the likely situation here is that your parent process terminated before")
@@ -73,10 +445,10 @@ def check_exe_basename(process, basename, basename_regex=None):
     else:
         print_info("This might be different than expected because of symbolic links (for example, from /usr/bin/python to /usr/bin/python3 to /usr/bin/python3.8).")
 
-    goal_basename = os.path.basename(os.path.realpath(shutil.which(basename)))
-    found_basename = os.path.basename(os.path.realpath(shutil.which(process.exe())))
+    goal_basename = resolve_exe_basename(basename)
+    found_basename = resolve_exe_basename(exe)
     print_info(f"To pass the checks, the executable must be {goal_basename}.")
-    assert re.match(basename_regex, os.path.basename(os.path.realpath(shutil.which(process.exe())))), f"Executable must be '{goal_basename}'. Yours is: {found_basename}"
+    assert re.match(basename_regex, found_basename), f"Executable must be '{goal_basename}'. Yours is: {found_basename}"
 
 def check_ipython(process):
     print_test("We will now check that that the process is an interactive ipython instance.")
@@ -93,12 +465,106 @@ def check_python(process):
     check_exe_basename(process, 'python', r"python(\d(\.\d+)?)?$")
     assert len(process.cmdline()) == 2 and process.cmdline()[1].endswith(".py"), "The python process must be executing a python script that you wrote like this: `python my_script.py`"
 
+SHT_SYMTAB = 2
+SHT_DYNSYM = 11
+
+def elf_has_symbol(elf, name):
+    # looks for a .symtab or .dynsym symbol whose name contains the given name, directly in the mapped file
+    endian = "<" if elf[5] == 1 else ">"
+    shoff, = struct.unpack_from(f"{endian}Q", elf, 0x28)
+    shentsize, shnum = struct.unpack_from(f"{endian}HH", elf, 0x3a)
+    sections = [ struct.unpack_from(f"{endian}IIQQQQIIQQ", elf, shoff + i*shentsize) for i in range(shnum) ]
+
+    for _, sh_type, _, _, sh_offset, sh_size, sh_link, _, _, sh_entsize in sections:
+        if sh_type not in (SHT_SYMTAB, SHT_DYNSYM) or not sh_entsize:
+            continue
+        strtab_offset, strtab_size = sections[sh_link][4], sections[sh_link][5]
+        strtab_end = strtab_offset + strtab_size
+        for sym_offset in range(sh_offset, sh_offset + sh_size, sh_entsize):
+            st_name, = struct.unpack_from(f"{endian}I", elf, sym_offset)
+            name_start = strtab_offset + st_name
+            name_end = elf.find(b"\0", name_start, strtab_end)
+            if elf.find(name, name_start, strtab_end if name_end == -1 else name_end) != -1:
+                return True
+    return False
+
+def inspect_elf(path, symbol):
+    # returns whether the file is a 64-bit ELF, and whether it has the symbol, without copying it out of the page cache
+    count("binaries_inspected")
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as elf:
+            if elf[:4] != b"\x7fELF" or elf[4] != 2:
+                return False, False
+            try:
+                return True, elf_has_symbol(elf, symbol)
+            except (struct.error, IndexError):
+                return True, False
+    except (OSError, ValueError):
+        return False, False
+
+def load_binary_cache(path):
+    # the cache decides whether a binary passes, so we ignore it unless only we could have written it
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return { }
+    with open(fd) as f: #pylint:disable=unspecified-encoding
+        st = os.fstat(fd)
+        if st.st_uid != os.geteuid() or st.st_mode & 0o022:
+            return { }
+        try:
+            cache = json.load(f)
+        except ValueError:
+            return { }
+    return cache if isinstance(cache, dict) else { }
+
+def save_binary_cache(path, cache, max_entries):
+    # entries are kept in least-to-most recently used order
+    for key in list(cache)[:max(len(cache) - max_entries, 0)]:
+        del cache[key]
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f: #pylint:disable=unspecified-encoding
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def binary_cache_key(st, symbol):
+    # ctime can't be set from userspace, so a binary that is rewritten in place (even with its mtime restored) misses
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{st.st_ctime_ns}:{symbol.hex()}"
+
+def cached_inspect_elf(path, symbol, cache_path, max_entries):
+    # an unchanged binary is accepted with a single stat(). a changed one that is identical in content to one we have
+    # seen (e.g., recompiled from the same source) is accepted by its hash, and anything else is inspected.
+    try:
+        key = binary_cache_key(os.stat(path), symbol)
+        cache = load_binary_cache(cache_path)
+        entry = cache.pop(key, None)
+        if entry is None:
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            entry = next((e for e in cache.values() if e["sha256"] == digest and e["symbol"] == symbol.hex()), None)
+            if entry is None:
+                is_elf64, has_symbol = inspect_elf(path, symbol)
+                entry = { "sha256": digest, "symbol": symbol.hex(), "elf64": is_elf64, "has_symbol": has_symbol }
+            if binary_cache_key(os.stat(path), symbol) != key:
+                # the binary changed while we were looking at it, so don't remember anything about it
+                return entry["elf64"], entry["has_symbol"]
+    except OSError:
+        # e.g., the binary was deleted (and its exe link reads "... (deleted)"), which inspect_elf() handles
+        return inspect_elf(path, symbol)
+
+    cache[key] = entry
+    save_binary_cache(cache_path, cache, max_entries)
+    return entry["elf64"], entry["has_symbol"]
+
 def check_binary(process):
     print_test("Checking to make sure that the process is a custom binary that you created by compiling a C program")
     print_test("that you wrote. Make sure your C program has a function called 'pwncollege' in it --- otherwise,")
     print_test("it won't pass the checks.")
 
-    if process == PARENT:
+    if process.pid == PARENT_PID:
         print_hint("If this is a check for the *parent* process, keep in mind that the exec() family of system calls")
         print_hint("does NOT result in a parent-child relationship. The exec()ed process simply replaces the exec()ing")
         print_hint("process. Parent-child relationships are created when a process fork()s off a child-copy of itself,")
@@ -118,8 +584,13 @@ def check_binary(process):
 
     assert process.exe().startswith("/home"), "The process must be your own program in your own home directory."
     assert len(process.cmdline()) == 1, "The process must have been called with no commandline arguments (argc == 1)."
-    assert b"ELF 64" in subprocess.check_output(["/usr/bin/file", process.exe() ], stderr=subprocess.PIPE), "The program must be a compiled C program."
-    assert b"pwncollege" in subprocess.check_output([ "/usr/bin/nm", "-a", process.exe() ], stderr=subprocess.PIPE), "The program must contain a function named 'pwncollege'."
+    cache_path = getattr(_args, "chio_binary_cache", None)
+    if cache_path:
+        is_elf64, has_pwncollege = cached_inspect_elf(process.exe(), b"pwncollege", cache_path, _args.chio_binary_cache_size)
+    else:
+        is_elf64, has_pwncollege = inspect_elf(process.exe(), b"pwncollege")
+    assert is_elf64, "The program must be a compiled C program."
+    assert has_pwncollege, "The program must contain a function named 'pwncollege'."
 
 def check_bash(process):
     print_test("Checking to make sure the process is the bash shell. If this is a check for the parent process, then,")
@@ -165,16 +636,12 @@ PROCESS_TYPE_CHECKERS = {
 # Checking FD redirection
 #
 
-def resolve_fd_path(pid, fd):
-    path = os.path.realpath(f"/proc/{pid}/fd/{fd}")
-    if path.startswith(f"/proc/{pid}/fd/"):
-        # fixup for sockets and pipes
-        path = os.path.basename(path)
-    return path
-
 def name_fd(fd):
     return "stdin" if fd == 0 else "stdout" if fd == 1 else "stderr" if fd == 2 else f"file descriptor {fd}"
 
+def is_redirected(fd):
+    return SELF_FDS.get(fd) is not None and SELF_FDS[fd].kind not in ("pipe", "socket", "tty", "deleted")
+
 def check_fd_path(fd, path, verbose=False):
     if verbose:
         print_test(f"I will now check that you redirected {path} to/from my {name_fd(fd)}.")
@@ -183,9 +650,13 @@ def check_fd_path(fd, path, verbose=False):
     print_hint("For security reasons, some programs, such as python, do this by default in certain cases. Be careful if you are")
     print_hint("creating and trying to pass in FDs in python.")
 
-    actual_path = resolve_fd_path(os.getpid(), fd)
-    assert os.path.exists(actual_path) and not actual_path.startswith("/dev/pts"), f"You have not redirected anything for this process' {name_fd(fd)}."
-    assert actual_path == os.path.realpath(path), f"You have redirected the wrong file for {name_fd(fd)} ({actual_path} instead of {path})."
+    assert is_redirected(fd), f"You have not redirected anything for this process' {name_fd(fd)}."
+    try:
+        path_st = os.stat(path)
+        same_file = (path_st.st_dev, path_st.st_ino) == (SELF_FDS[fd].dev, SELF_FDS[fd].ino)
+    except OSError:
+        same_file = False
+    assert same_file, f"You have redirected the wrong file for {name_fd(fd)} ({SELF_FDS[fd].link} instead of {path})."
 
 def check_stdin_path(path):
     check_fd_path(0, path)
@@ -199,52 +670,186 @@ def check_fifo(fd):
     print_hint("processes that read from it. Look at the mkfifo man page and play around with FIFOs on the commandline to get a feel")
     print_hint("for them.")
 
-    path = resolve_fd_path(os.getpid(), fd)
-    assert os.path.exists(path) and not path.startswith("/dev/pts"), f"You have not redirected anything to/from this process' {name_fd(fd)}."
-    assert stat.S_ISFIFO(os.stat(path).st_mode), f"{name_fd(fd)} is not referencing a FIFO."
+    assert is_redirected(fd), f"You have not redirected anything to/from this process' {name_fd(fd)}."
+    assert SELF_FDS[fd].kind == "fifo", f"{name_fd(fd)} is not referencing a FIFO."
 
 #
 # Checking FD partners.
 #
 
-def resolve_fd_socket_partner(pid, fd):
-    our_socket = resolve_fd_path(pid, fd)
-    assert our_socket.startswith("socket:"), "You did not make a network connection to this process."
+def read_scope_key(pid, scope):
+    if scope != "all":
+        count("proc_reads")
+    if scope == "pidns":
+        return os.readlink(f"/proc/{pid}/ns/pid")
+    if scope == "cgroup":
+        with open(f"/proc/{pid}/cgroup") as f: #pylint:disable=unspecified-encoding
+            return f.read()
+    if scope == "uid":
+        # the real uid: a setuid chio is not dumpable, so its /proc directory belongs to root rather than the student
+        with open(f"/proc/{pid}/status") as f: #pylint:disable=unspecified-encoding
+            return next(line.split()[1] for line in f if line.startswith("Uid:"))
+    return None
+
+def iter_fd_links(pid, scope="all"):
+    # yields (pid, link) for the fds of every other process in our scope, in pid order
+    our_scope = read_scope_key(pid, scope)
+    count("proc_reads")
+    for other in sorted(int(p) for p in os.listdir("/proc") if p.isdigit()):
+        if other == pid or other in CHECKER_PIDS:
+            continue
 
-    # this is dumb, but works
-    for p in (SELF, SELF.parent(), SELF.parent().parent()):
+        count("proc_reads")
         try:
-            our_connection = next(c for c in p.connections() if resolve_fd_path(p.pid, c.fd) == our_socket)
-            break
-        except StopIteration:
-            pass
-    else:
-        raise RuntimeError("Connection check failed to find a connection. Please report this; it is not your fault.")
+            if read_scope_key(other, scope) != our_scope:
+                continue
+            other_fds = os.listdir(f"/proc/{other}/fd")
+        except OSError:
+            continue
 
+        count("proc_reads", len(other_fds))
+        for ofd in other_fds:
+            try:
+                yield other, os.readlink(f"/proc/{other}/fd/{ofd}")
+            except OSError:
+                continue
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLMSG_ERROR = 2
+NLM_F_REQUEST = 1
+INET_DIAG_NOCOOKIE = 0xffffffff
+NLMSG_HEADER = struct.Struct("=IHHII")
+INET_DIAG_REQ = struct.Struct("=BBBxI2s2s16s16sIII")
+INET_DIAG_MSG_INODE = struct.Struct("=I")
+INET_DIAG_MSG_INODE_OFFSET = 68
+
+def sock_diag_inode(family, src, dst):
+    # asks the kernel for the inode of the TCP socket with exactly this (src, dst) 4-tuple
+    request = INET_DIAG_REQ.pack(
+        family, socket.IPPROTO_TCP, 0, 0xffffffff,
+        src[1].to_bytes(2, "big"), dst[1].to_bytes(2, "big"),
+        socket.inet_pton(family, src[0]).ljust(16, b"\0"), socket.inet_pton(family, dst[0]).ljust(16, b"\0"),
+        0, INET_DIAG_NOCOOKIE, INET_DIAG_NOCOOKIE
+    )
+    count("netlink_queries")
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG) as s:
+        s.sendto(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST, 1, 0) + request, (0, 0))
+        response = s.recv(65536)
+
+    _, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(response)
+    if msg_type == NLMSG_ERROR:
+        error = -struct.unpack_from("=i", response, NLMSG_HEADER.size)[0]
+        if error == errno.ENOENT:
+            return None
+        raise OSError(error, os.strerror(error))
+    return INET_DIAG_MSG_INODE.unpack_from(response, NLMSG_HEADER.size + INET_DIAG_MSG_INODE_OFFSET)[0]
+
+def proc_net_address(family, address):
+    # /proc/net/tcp{,6} lists addresses as host-endian 32-bit words, followed by the port
+    packed = socket.inet_pton(family, address[0])
+    words = struct.unpack(f"={len(packed)//4}I", packed)
+    return "".join(f"{w:08X}" for w in words) + f":{address[1]:04X}"
+
+def proc_net_inode(family, src, dst):
+    # the slow path, for when sock_diag is unavailable
+    count("proc_reads")
+    with open("/proc/net/tcp6" if family == socket.AF_INET6 else "/proc/net/tcp") as f: #pylint:disable=unspecified-encoding
+        for line in f.readlines()[1:]:
+            fields = line.split()
+            if fields[1] == proc_net_address(family, src) and fields[2] == proc_net_address(family, dst):
+                return int(fields[9])
+    return None
+
+def resolve_fd_socket_partner(pid, fd, scope="all"):
+    assert SELF_FDS.get(fd) is not None and SELF_FDS[fd].kind == "socket", "You did not make a network connection to this process."
+
+    with socket.socket(fileno=os.dup(fd)) as s:
+        assert s.family in (socket.AF_INET, socket.AF_INET6), "You did not make a network connection to this process."
+        family = s.family
+        our_address = s.getsockname()
+        their_address = s.getpeername()
+
+    # the client's socket is the one with our 4-tuple, reversed
     try:
-        their_pid = next(o for o in psutil.net_connections() if o.raddr == our_connection.laddr).pid
-    except StopIteration:
-        #pylint: disable=raise-missing-from
-        raise AssertionError("You did not make a connection from within this container, or your client process terminated prematurely.")
-    return their_pid
+        their_inode = sock_diag_inode(family, their_address, our_address)
+    except OSError:
+        their_inode = proc_net_inode(family, their_address, our_address)
 
-def resolve_fd_pipe_partner(pid, fd, parent_ok=False):
-    our_pipe = resolve_fd_path(pid, fd)
-    assert our_pipe.startswith("pipe:"), f"{name_fd(fd)} of this process does not appear to be a pipe!"
-
-    for p in psutil.process_iter():
-        if p == SELF:
-            continue
-        if p.pid == PARENT.pid and not parent_ok:
-            continue
+    their_socket = f"socket:[{their_inode}]"
+    their_pid = next((other for other,link in iter_fd_links(pid, scope) if link == their_socket), None) if their_inode else None
+    assert their_pid is not None, "You did not make a connection from within this container, or your client process terminated prematurely."
+    return their_pid
 
+def resolve_pipe_partners(pid, requests, scope="all"):
+    # requests are (fd, parent_ok) pairs, and all of them are resolved in a single pass over /proc
+    our_pipes = { }
+    for fd,_ in requests:
+        count("proc_reads")
         try:
-            for ofd in os.listdir(f"/proc/{p.pid}/fd"):
-                their_pipe = resolve_fd_path(p.pid, int(ofd))
-                if their_pipe == our_pipe:
-                    return p.pid
-        except PermissionError:
+            our_pipes[fd] = os.readlink(f"/proc/{pid}/fd/{fd}")
+        except OSError:
             pass
+    holders = { pipe: [ ] for pipe in our_pipes.values() if pipe.startswith("pipe:") }
+    parent_ok_only = { pipe: all(parent_ok for fd,parent_ok in requests if our_pipes.get(fd) == pipe) for pipe in holders }
+
+    remaining = set(holders)
+    for other, their_pipe in iter_fd_links(pid, scope):
+        if not remaining:
+            break
+        if their_pipe in holders and other not in holders[their_pipe]:
+            holders[their_pipe].append(other)
+            # once a non-parent process holds the pipe, later processes can no longer change any answer
+            if other != PARENT_PID or parent_ok_only[their_pipe]:
+                remaining.discard(their_pipe)
+
+    return {
+        (fd, parent_ok): next((p for p in holders.get(our_pipes.get(fd), [ ]) if parent_ok or p != PARENT_PID), None)
+        for fd,parent_ok in requests
+    }
+
+def wait_for_pipe_partners(pid, requests, timeout, scope="all"):
+    # polls with exponential backoff until every pipe has a partner that has finished launching, or until the timeout
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        partners = resolve_pipe_partners(pid, requests, scope=scope)
+        if all(
+            (partner is not None and not is_unexeced_fork(partner)) or SELF_FDS.get(fd) is None or SELF_FDS[fd].kind != "pipe"
+            for (fd,_),partner in partners.items()
+        ):
+            return partners
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return partners
+        time.sleep(min(delay, remaining))
+        delay *= 2
+
+def startup_pipe_partners(requests):
+    # answers whatever requests we can from the partners recorded at startup, the same way resolve_pipe_partners() would
+    partners = { }
+    for fd,parent_ok in requests:
+        partner = next((p.pid for p in STARTUP_PARTNERS.get(fd, [ ]) if parent_ok or p.pid != PARENT_PID), None)
+        if partner is not None and not is_unexeced_fork(partner):
+            partners[(fd, parent_ok)] = partner
+    return partners
+
+def open_process(pid):
+    # startup partners that have since exited are checked based on what we recorded about them
+    snapshot = next((p for partners in STARTUP_PARTNERS.values() for p in partners if p.pid == pid), None)
+    if snapshot is not None and not snapshot.is_running():
+        return snapshot
+    return ProcessSnapshot(pid)
+
+def resolve_fd_pipe_partner(pid, fd, parent_ok=False, partners=None, scope="all"):
+    assert SELF_FDS.get(fd) is not None and SELF_FDS[fd].kind == "pipe", f"{name_fd(fd)} of this process does not appear to be a pipe!"
+
+    if partners is None:
+        partners = resolve_pipe_partners(pid, [ (fd, parent_ok) ], scope=scope)
+    partner = partners.get((fd, parent_ok))
+    if partner is not None:
+        return partner
 
     raise AssertionError(f"Unable to find the process on the other end of the {name_fd(fd)} pipe. There are many possible reasons for this, with the following three being the most likely:\n\t(1) The process on the other end of the pipe was launched with invalid arguments and quickly errored out, so it was gone by the time we checked. If that's the case, figure out the right arguments!\n\t(2) The process on the other end of the pipe was a fast-running processs (such as `cat some_file`, which just yeets the file to its stdout and exits). If that's the case, figure out how to make the process stick around!\n\t(3) This check happened *before* the other process successfully launched. This is a common occurrence if you're trying to redirect the stdout of this challenge to another process, you're manually doing this in an interactive ipython, and you're launching the challenge before launching the other process. Try pasting in both pwntools or subprocess invocations rapidly one after the other to get the second process launched in time!")
 
@@ -285,33 +890,179 @@ def check_env(k, v):
 # Challenge-response
 #
 
+# this reads fd 0 directly, rather than through sys.stdin, because setup_input() may dup2() a connection or input fd
+# over it, and it buffers so that pipelined responses are consumed with as few reads as possible
+_input_buffer = bytearray()
+def read_line():
+    deadline = wait_deadline()
+    while b"\n" not in _input_buffer:
+        wait_readable(0, deadline)
+        chunk = os.read(0, 0x10000)
+        if not chunk:
+            break
+        _input_buffer.extend(chunk)
+
+    if not _input_buffer:
+        raise EOFError("EOF when reading a line")
+    line_end = _input_buffer.find(b"\n") + 1 or len(_input_buffer)
+    line = bytes(_input_buffer[:line_end])
+    del _input_buffer[:line_end]
+    return line.decode(errors="replace").rstrip("\n")
+
+CHALLENGE_OPERATORS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "%": operator.mod,
+    "&": operator.and_,
+    "^": operator.xor,
+    "|": operator.or_,
+}
+DIVISION_OPS = "/%"
+BITWISE_OPS = "&^|"
+
+# the value of each subtree is computed as the tree is built, so that we never need to evaluate the final expression
 def generate_challenge(ops, depth, myrand):
     if depth == 0:
-        return str(myrand.randrange(1, 0x1000))
+        n = myrand.randrange(1, 0x1000)
+        return str(n), n
+
+    left, left_value = generate_challenge(ops, depth-1, myrand)
+    right, right_value = generate_challenge(ops, depth-1, myrand)
+
+    # make sure we're not dividing by zero, or doing bitwise operations on the floats that "/" makes
+    def usable_ops(right_value):
+        usable = ops if right_value else "".join(o for o in ops if o not in DIVISION_OPS)
+        if not isinstance(left_value, int) or not isinstance(right_value, int):
+            usable = "".join(o for o in usable if o not in BITWISE_OPS)
+        return usable
+    while not usable_ops(right_value):
+        right, right_value = generate_challenge(ops, depth-1, myrand)
+    op = myrand.choice(usable_ops(right_value))
 
-    left = generate_challenge(ops, depth-1, myrand)
-    right = generate_challenge(ops, depth-1, myrand)
-    op = myrand.choice(ops)
-
-    # make sure we're not dividing by zero
     challenge = f"({left}) {op} ({right})" if depth > 1 else f"{left}{op}{right}"
-    if asteval.Interpreter()(challenge) is None:
-        return generate_challenge(ops, depth, myrand)
-    else:
-        return challenge
+    return challenge, CHALLENGE_OPERATORS[op](left_value, right_value)
+
+# keyed by the names of the ast node types, so that ast is only imported once a challenge is actually evaluated
+AST_OPERATORS = {
+    "Add": operator.add,
+    "Sub": operator.sub,
+    "Mult": operator.mul,
+    "Div": operator.truediv,
+    "Mod": operator.mod,
+    "BitAnd": operator.and_,
+    "BitXor": operator.xor,
+    "BitOr": operator.or_,
+}
 
-def check_challenges(num, ops, depth, myrand=random):
-    for _ in range(num):
-        challenge = generate_challenge(ops, myrand.randrange(depth), myrand)
-        print_test(f"CHALLENGE! Please send the solution for: {challenge}")
-        response = input()
-        expected = str(asteval.Interpreter()(challenge))
-        assert response == expected, f"Your response is incorrect! I expected {expected} but got {response}."
-        print_pass("CORRECT!")
+# an independent evaluation of a challenge, used to verify precomputed solutions
+def evaluate_challenge(challenge):
+    count("challenges_evaluated")
+    def _evaluate(node):
+        if isinstance(node, ast.Constant):
+            return node.value
+        return AST_OPERATORS[type(node.op).__name__](_evaluate(node.left), _evaluate(node.right))
+    return _evaluate(ast.parse(challenge, mode="eval").body)
+
+# The challenge bank is a file of precomputed challenges, laid out as a header (magic, number of sections), a table of
+# (ops, depth, number of challenges, position of the offset table) for each section, and, for each section, an offset
+# table of count+1 positions followed by the "challenge\tsolution" records. It is mmap()ed, so serving a challenge is
+# a couple of lookups into the page cache.
+
+CHALLENGE_BANK_MAGIC = b"CHIOBNK1"
+CHALLENGE_BANK_HEADER = struct.Struct("<8sI")
+CHALLENGE_BANK_SECTION = struct.Struct("<16sIIQ")
+CHALLENGE_BANK_RECORD = struct.Struct("<QQ")
+
+def load_challenge_bank(path):
+    with open(path, "rb") as f:
+        bank_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, num_sections = CHALLENGE_BANK_HEADER.unpack_from(bank_map)
+    if magic != CHALLENGE_BANK_MAGIC:
+        raise RuntimeError(f"The challenge bank at {path} is corrupted. Please report this; it is not your fault.")
+
+    bank = { }
+    for i in range(num_sections):
+        ops, depth, num_challenges, table_pos = CHALLENGE_BANK_SECTION.unpack_from(bank_map, CHALLENGE_BANK_HEADER.size + i*CHALLENGE_BANK_SECTION.size)
+        bank[(ops.rstrip(b"\0").decode(), depth)] = (bank_map, num_challenges, table_pos)
+    return bank
+
+def read_banked_challenge(section, n):
+    bank_map, _, table_pos = section
+    start, end = CHALLENGE_BANK_RECORD.unpack_from(bank_map, table_pos + n*8)
+    challenge, solution = bank_map[start:end].decode().split("\t")
+    return challenge, solution
+
+def iter_banked_challenges(section):
+    for n in range(section[1]):
+        yield read_banked_challenge(section, n)
+
+def write_challenge_bank(path, sections):
+    table = b""
+    body = bytearray()
+    body_pos = CHALLENGE_BANK_HEADER.size + len(sections)*CHALLENGE_BANK_SECTION.size
+    for (ops, depth), records in sections.items():
+        assert len(ops.encode()) <= 16, "Challenge bank ops can be at most 16 characters long."
+        table_pos = body_pos + len(body)
+        table += CHALLENGE_BANK_SECTION.pack(ops.encode(), depth, len(records), table_pos)
+
+        offsets = [ table_pos + 8*(len(records)+1) ]
+        for r in records:
+            offsets.append(offsets[-1] + len(r))
+        body += struct.pack(f"<{len(offsets)}Q", *offsets)
+        body += b"".join(records)
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(CHALLENGE_BANK_HEADER.pack(CHALLENGE_BANK_MAGIC, len(sections)))
+        f.write(table)
+        f.write(body)
+    os.replace(path + ".tmp", path)
+
+def build_challenge_bank(path, ops, depth, size, myrand=random):
+    assert size >= 1, "ERROR: --challenge_bank_size must be at least 1."
+    sections = { }
+    if os.path.exists(path):
+        sections = {
+            key: [ f"{c}\t{s}".encode() for c,s in iter_banked_challenges(section) ]
+            for key,section in load_challenge_bank(path).items()
+        }
+
+    # check_challenges() picks a depth below the requested one for each challenge, so we bank all of them
+    for d in range(depth):
+        sections[(ops, d)] = [ "{}\t{}".format(*generate_challenge(ops, d, myrand)).encode() for _ in range(size) ]
+    write_challenge_bank(path, sections)
+
+    for (bank_ops, bank_depth), section in load_challenge_bank(path).items():
+        for challenge, solution in iter_banked_challenges(section):
+            assert str(evaluate_challenge(challenge)) == solution, f"Banked solution for {challenge} is wrong ({solution} instead of {evaluate_challenge(challenge)})."
+        print_pass(f"Verified {section[1]} banked challenges for ops {bank_ops} at depth {bank_depth}.")
+
+def next_challenge(ops, depth, myrand, bank=None):
+    challenge_depth = myrand.randrange(depth)
+    # an empty section (e.g., from a bank written by hand) is treated as missing
+    section = bank and bank.get((ops, challenge_depth))
+    if section and section[1]:
+        return read_banked_challenge(section, myrand.randrange(section[1]))
+    return generate_challenge(ops, challenge_depth, myrand)
+
+def check_challenges(num, ops, depth, myrand=random, batch=1, bank=None):
+    for start in range(0, num, batch):
+        solutions = [ ]
+        for _ in range(min(batch, num - start)):
+            challenge, solution = next_challenge(ops, depth, myrand, bank=bank)
+            print_test(f"CHALLENGE! Please send the solution for: {challenge}")
+            solutions.append(str(solution))
+
+        # responses are verified as they stream in, so a solver can pipeline the whole batch
+        for expected in solutions:
+            response = read_line()
+            assert response == expected, f"Your response is incorrect! I expected {expected} but got {response}."
+            print_pass("CORRECT!")
 
 def check_password(password):
     print_info("Reading in your input now...")
-    response = input().strip()
+    response = read_line().strip()
     assert response == password, f"You entered the wrong password ({response} instead of {password})."
 
 #
@@ -321,8 +1072,7 @@ def check_password(password):
 SIGNALS = [ "SIGUSR1", "SIGUSR2", "SIGINT", "SIGABRT", "SIGHUP" ]
 EXPECTED_SIGNALS = [ ]
 
-def handle_signal(snum, _):
-    print_info(f"Received signal {snum}! Is it correct?")
+def verify_signal(snum):
     if snum == getattr(signal, EXPECTED_SIGNALS[-1]):
         print_pass("Correct!")
         EXPECTED_SIGNALS.pop()
@@ -330,25 +1080,260 @@ def handle_signal(snum, _):
         print_fail("Incorrect signal received. Exiting.")
         sys.exit(1)
 
+def handle_signal(snum, _):
+    print_info(f"Received signal {snum}! Is it correct?")
+    verify_signal(snum)
+
 def setup_handlers():
     for s in SIGNALS:
         snum = getattr(signal, s)
         signal.signal(snum, handle_signal)
 
-def check_signals(num, myrand=random):
-    setup_handlers()
+def check_signals(num, myrand=random, mode="sigwait"):
+    snums = [ getattr(signal, s) for s in SIGNALS ]
+    if mode == "sigwait":
+        # blocked signals stay pending until we wait for them, so none can slip by before the loop starts. they stay
+        # blocked afterwards, so that stray extra signals don't kill us before we report success.
+        signal.pthread_sigmask(signal.SIG_BLOCK, snums)
+    elif mode == "handler":
+        setup_handlers()
+
     EXPECTED_SIGNALS[:] = [ myrand.choice(SIGNALS) for _ in range(num) ]
-    print_test(f"You must send me (PID {os.getpid()}) the following signals, in exactly this order: {EXPECTED_SIGNALS[::-1]}")
+    print_test(f"You must send me (PID {SELF_PID}) the following signals, in exactly this order: {EXPECTED_SIGNALS[::-1]}")
+
+    if mode == "proxy":
+        # when running as a service, the launcher catches the signals and forwards them over the session socket
+        while EXPECTED_SIGNALS:
+            wait_readable(_session_socket.fileno(), wait_deadline())
+            record = _session_socket.recv(SIGNAL_RECORD.size, socket.MSG_WAITALL)
+            assert len(record) == SIGNAL_RECORD.size, "The launcher exited before you sent all of the signals."
+            snum, sender = SIGNAL_RECORD.unpack(record)
+            print_info(f"Received signal {snum} from PID {sender}! Is it correct?")
+            verify_signal(snum)
+        return
+
+    if mode == "sigwait":
+        while EXPECTED_SIGNALS:
+            deadline = wait_deadline()
+            flush_output()
+            info = signal.sigwaitinfo(snums) if deadline is None else signal.sigtimedwait(snums, time_left(deadline))
+            if info is None:
+                raise SessionTimeout()
+            print_info(f"Received signal {info.si_signo} from PID {info.si_pid}! Is it correct?")
+            verify_signal(info.si_signo)
+        return
+
+    deadline = wait_deadline()
     while EXPECTED_SIGNALS:
         old_size = len(EXPECTED_SIGNALS)
-        time.sleep(1)
+        flush_output()
+        time.sleep(min(1, time_left(deadline) or 1))
         if len(EXPECTED_SIGNALS) != old_size:
             print_info("Nice, you sent one of the signals!")
+            deadline = wait_deadline()
+        time_left(deadline)
 
 #
 # Main code
 #
 
+class BackgroundCall:
+    # runs a function on a daemon thread, so that an early failure never has to wait for slow checks to finish
+    __slots__ = [ "_thread", "_result", "_error" ]
+
+    def __init__(self, function, *function_args):
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(function,)+function_args, daemon=True)
+        self._thread.start()
+
+    def _run(self, function, *function_args):
+        try:
+            self._result = function(*function_args)
+        except BaseException as e: #pylint:disable=broad-except
+            self._error = e
+
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+def run_captured(name, step, args, context):
+    # returns the messages the step printed, and the exception it failed with (if any)
+    _captured.messages = [ ]
+    try:
+        profiled(name, step, args, context)
+        return _captured.messages, None
+    except Exception as e: #pylint:disable=broad-except
+        return _captured.messages, e
+    finally:
+        _captured.messages = None
+
+def resolve_requested_pipe_partners(args):
+    pipe_requests = [ (fd, parent_ok) for fd,parent_ok,requested in (
+        (0, False, args.check_stdin_pipe),
+        (1, False, args.check_stdout_pipe),
+        (2, False, args.check_stderr_pipe),
+        (0, True, args.check_stdin_parent),
+        (1, True, args.check_stdout_parent),
+    ) if requested ]
+
+    # give the parent process enough time to spawn the partner, in case of stdout/stderr piping
+    partner_timeout = args.chio_partner_timeout if args.check_stdout_pipe or args.check_stderr_pipe else 0
+    pipe_partners = startup_pipe_partners(pipe_requests)
+    missing_requests = [ r for r in pipe_requests if r not in pipe_partners ]
+    if missing_requests:
+        pipe_partners.update(wait_for_pipe_partners(SELF_PID, missing_requests, partner_timeout, scope=args.chio_scan_scope))
+    return pipe_partners
+
+def step_parent(args, _):
+    print_test("Performing checks on the parent process of this process.")
+    PROCESS_TYPE_CHECKERS[args.parent](ProcessSnapshot(PARENT_PID))
+    print_pass("You have passed the checks on the parent process!")
+
+def step_client(args, _):
+    print_test("This is a network server. Trying to determine the client process...")
+    client = ProcessSnapshot(resolve_fd_socket_partner(SELF_PID, 0, scope=args.chio_scan_scope))
+    print_test("Performing tests on the client process!")
+    PROCESS_TYPE_CHECKERS[args.client](client)
+    print_pass("You have passed the checks on the client process!")
+
+def pipe_step(fd, arg, announcement):
+    def step(args, context):
+        print_test(announcement)
+        partner = open_process(resolve_fd_pipe_partner(SELF_PID, fd, parent_ok=False, partners=context["pipe_partners"].result()))
+        print_test("Performing checks on that process!")
+        PROCESS_TYPE_CHECKERS[getattr(args, arg)](partner)
+        print_pass(f"You have passed the checks on the process on the other end of my {name_fd(fd)}!")
+    return step
+
+def parent_pipe_step(fd):
+    def step(_, context):
+        print_test(f"You should have connected my {name_fd(fd)} to my parent process. Checking...")
+        partner = open_process(resolve_fd_pipe_partner(SELF_PID, fd, parent_ok=True, partners=context["pipe_partners"].result()))
+        assert partner.pid == PARENT_PID, f"It looks like {name_fd(fd)} is connected to some other process than my parent!"
+        print_pass(f"Looks like you connected my {name_fd(fd)} to my parent process!")
+    return step
+
+def path_step(fd, arg, announcement):
+    def step(args, _):
+        path = getattr(args, arg)
+        print_test(announcement.format(path))
+        check_fd_path(fd, path)
+        print_pass(f"The file at the other end of my {name_fd(fd)} looks okay!")
+    return step
+
+def fifo_step(fd, announcement):
+    def step(*_):
+        print_test(announcement)
+        check_fifo(fd)
+        print_pass(f"Looks like my {name_fd(fd)} is connected to a FIFO!")
+    return step
+
+def step_cwd(args, _):
+    print_test(f"You should launch me with a working directory of {args.cwd}.")
+    check_cwd(ProcessSnapshot(SELF_PID), args.cwd)
+    print_pass("Looks like my working directory is correct!")
+
+def step_parent_different_cwd(*_):
+    print_test("My working directory should be different than the parent process'!")
+    my_cwd = read_proc_link(SELF_PID, "cwd")
+    parent_cwd = read_proc_link(PARENT_PID, "cwd")
+    print_info(f"My working directory is: {my_cwd}.")
+    print_info(f"Parent working directory is: {parent_cwd}.")
+    assert my_cwd != parent_cwd, "Parent process' and this process' working directories are the same!"
+    print_pass("Looks like my working directory is different than my parent's!")
+
+def step_check_arg(args, _):
+    ns,v = args.check_arg.split(":")
+    n = int(ns)
+    print_test(f"My argv[{n}] should have a value of {v}! Let's check...")
+    check_arg(args.old_args[1:], n, v)
+    print_pass("You successfully passed the argument value check!")
+
+def step_check_env(args, _):
+    k,v = args.check_env.split(":")
+    print_test(f"My '{k}' environment variable should have a value of {v}! Let's check...")
+    check_env(k, v)
+    print_pass("You successfully passed the environment value check!")
+
+def step_empty_env(args, _):
+    print_test(f"You should launch me with an {'otherwise-' if args.check_env else ''}empty environment. Checking...")
+    check_env_count(1 if args.check_env else 0)
+    print_pass("You successfully passed the empty environment check!")
+
+def step_empty_argv(args, _):
+    print_test("You should launch me with an empty argv (i.e., argc == 0). Checking...")
+    assert not args.old_args[1:], f"argv is not empty, but has {len(args.old_args[1:])} entries..."
+    print_pass("You successfully passed the empty argument check!")
+
+def step_password(args, _):
+    print_test(f"This program expects you to enter a simple password (specifically, {args.password}). Send it now!")
+    check_password(args.password)
+    print_pass("You successfully passed the password!")
+
+def step_challenges(args, _):
+    print_info(f"This program will send you {args.num_challenges} mathematical challenge{'s' if args.num_challenges>1 else ''} that you will need to compute responses for.")
+    bank = load_challenge_bank(args.challenge_bank) if args.challenge_bank else None
+    check_challenges(args.num_challenges, args.challenge_ops, args.challenge_depth, batch=args.challenge_batch or 1, bank=bank)
+    print_pass("You successfully passed the mathematical challenges!")
+
+def step_signals(args, _):
+    print_info("This program will stop and wait for you to send it a number of signals. For more information on signals,")
+    print_info("look at the man page of the kill command.")
+    check_signals(args.num_signals, mode=args.chio_signal_mode)
+    print_pass("You successfully passed the signal challenges!")
+
+# how expensive each check is to run, for --chio_schedule cost
+COST_SELF = 0 # our own environment, argv, cwd, and fds
+COST_PROCESS = 1 # another specific process, or files that it points to
+COST_SCAN = 2 # a walk over every process on the system
+COST_INTERACTIVE = 3 # waits on the user, and always runs last and in order
+
+# the checks, in the order that they are reported: (name, the argument that requests it, the step, its cost)
+CHECK_PLAN = [
+    ("parent", "parent", step_parent, COST_PROCESS),
+    ("client", "client", step_client, COST_SCAN),
+    ("stdin_pipe", "check_stdin_pipe", pipe_step(0, "check_stdin_pipe", "You should have redirected another process to my stdin. Checking..."), COST_SCAN),
+    ("stdout_pipe", "check_stdout_pipe", pipe_step(1, "check_stdout_pipe", "You should have redirected my stdout to another process. Checking..."), COST_SCAN),
+    ("stderr_pipe", "check_stderr_pipe", pipe_step(2, "check_stderr_pipe", "You should have redirected my stderr to another process. Checking..."), COST_SCAN),
+    ("stdin_parent", "check_stdin_parent", parent_pipe_step(0), COST_SCAN),
+    ("stdout_parent", "check_stdout_parent", parent_pipe_step(1), COST_SCAN),
+    ("stdin_path", "check_stdin_path", path_step(0, "check_stdin_path", "You should have redirected a file called {} to my stdin. Checking..."), COST_SELF),
+    ("stdout_path", "check_stdout_path", path_step(1, "check_stdout_path", "You should have redirected my stdout to a file called {}. Checking..."), COST_SELF),
+    ("stderr_path", "check_stderr_path", path_step(2, "check_stderr_path", "You should have redirected my stderr to {}. Checking..."), COST_SELF),
+    ("stdin_fifo", "check_stdin_fifo", fifo_step(0, "You should have redirected a FIFO to my stdin. Checking..."), COST_SELF),
+    ("stdout_fifo", "check_stdout_fifo", fifo_step(1, "You should have redirected my stdout to a FIFO. Checking..."), COST_SELF),
+    ("cwd", "cwd", step_cwd, COST_SELF),
+    ("parent_different_cwd", "parent_different_cwd", step_parent_different_cwd, COST_SELF),
+    ("check_arg", "check_arg", step_check_arg, COST_SELF),
+    ("check_env", "check_env", step_check_env, COST_SELF),
+    ("empty_env", "empty_env", step_empty_env, COST_SELF),
+    ("empty_argv", "empty_argv", step_empty_argv, COST_SELF),
+    ("password", "password", step_password, COST_INTERACTIVE),
+    ("challenges", "num_challenges", step_challenges, COST_INTERACTIVE),
+    ("signals", "num_signals", step_signals, COST_INTERACTIVE),
+]
+PIPE_PARTNER_CHECKS = [ "stdin_pipe", "stdout_pipe", "stderr_pipe", "stdin_parent", "stdout_parent" ]
+
+def run_stage(stage, args, context):
+    # the non-interactive checks all run at once, but their results are reported in order, stopping at the first failure
+    running = { name: BackgroundCall(run_captured, name, step, args, context) for name,step,cost in stage if cost != COST_INTERACTIVE }
+    for name,step,cost in stage:
+        if cost == COST_INTERACTIVE:
+            profiled(name, step, args, context)
+            continue
+
+        messages, error = running[name].result()
+        for mtype, msgs in messages:
+            print_msg(mtype, *msgs)
+        if error is not None:
+            raise error
+
+def plan_checks(args):
+    return [ (name, step, cost) for name,arg,step,cost in CHECK_PLAN if getattr(args, arg) ]
+
 def do_checks(args):
     print_info("This challenge will perform a bunch of checks.")
     if args.reward:
@@ -356,150 +1341,132 @@ def do_checks(args):
     else:
         print_info("Good luck!")
 
-    if args.parent:
-        print_test("Performing checks on the parent process of this process.")
-        PROCESS_TYPE_CHECKERS[args.parent](PARENT)
-        print_pass("You have passed the checks on the parent process!")
-
-    if args.client:
-        print_test("This is a network server. Trying to determine the client process...")
-        client = psutil.Process(resolve_fd_socket_partner(os.getpid(), 0))
-        print_test("Performing tests on the client process!")
-        PROCESS_TYPE_CHECKERS[args.client](client)
-        print_pass("You have passed the checks on the client process!")
-
-    if args.check_stdin_pipe:
-        print_test("You should have redirected another process to my stdin. Checking...")
-        partner = psutil.Process(resolve_fd_pipe_partner(os.getpid(), 0, parent_ok=False))
-        print_test("Performing checks on that process!")
-        PROCESS_TYPE_CHECKERS[args.check_stdin_pipe](partner)
-        print_pass("You have passed the checks on the process on the other end of my stdin!")
-    if args.check_stdout_pipe:
-        print_test("You should have redirected my stdout to another process. Checking...")
-        time.sleep(1) # sleep to give the parent process enough time to spawn the partner, in case of stdout piping
-        partner = psutil.Process(resolve_fd_pipe_partner(os.getpid(), 1, parent_ok=False))
-        print_test("Performing checks on that process!")
-        PROCESS_TYPE_CHECKERS[args.check_stdout_pipe](partner)
-        print_pass("You have passed the checks on the process on the other end of my stdout!")
-    if args.check_stderr_pipe:
-        print_test("You should have redirected my stderr to another process. Checking...")
-        time.sleep(1) # sleep to give the parent process enough time to spawn the partner, in case of stderr piping
-        partner = psutil.Process(resolve_fd_pipe_partner(os.getpid(), 2, parent_ok=False))
-        print_test("Performing checks on that process!")
-        PROCESS_TYPE_CHECKERS[args.check_stderr_pipe](partner)
-        print_pass("You have passed the checks on the process on the other end of my stderr!")
-
-    if args.check_stdin_parent:
-        print_test("You should have connected my stdin to my parent process. Checking...")
-        partner = psutil.Process(resolve_fd_pipe_partner(os.getpid(), 0, parent_ok=True))
-        assert partner == PARENT, "It looks like stdin is connected to some other process than my parent!"
-        print_pass("Looks like you connected my stdin to my parent process!")
-    if args.check_stdout_parent:
-        print_test("You should have connected my stdout to my parent process. Checking...")
-        partner = psutil.Process(resolve_fd_pipe_partner(os.getpid(), 1, parent_ok=True))
-        assert partner == PARENT, "It looks like stdout is connected to some other process than my parent!"
-        print_pass("Looks like you connected my stdout to my parent process!")
-
-    if args.check_stdin_path:
-        print_test(f"You should have redirected a file called {args.check_stdin_path} to my stdin. Checking...")
-        check_stdin_path(args.check_stdin_path)
-        print_pass("The file at the other end of my stdin looks okay!")
-    if args.check_stdout_path:
-        print_test(f"You should have redirected my stdout to a file called {args.check_stdout_path}. Checking...")
-        check_stdout_path(args.check_stdout_path)
-        print_pass("The file at the other end of my stdout looks okay!")
-    if args.check_stderr_path:
-        print_test(f"You should have redirected my stderr to {args.check_stderr_path}. Checking...")
-        check_stderr_path(args.check_stderr_path)
-        print_pass("The file at the other end of my stderr looks okay!")
-
-    if args.check_stdin_fifo:
-        print_test("You should have redirected a FIFO to my stdin. Checking...")
-        check_fifo(0)
-        print_pass("Looks like my stdin is connected to a FIFO!")
-    if args.check_stdout_fifo:
-        print_test("You should have redirected my stdout to a FIFO. Checking...")
-        check_fifo(1)
-        print_pass("Looks like my stdout is connected to a FIFO!")
-
-    if args.cwd:
-        print_test(f"You should launch me with a working directory of {args.cwd}.")
-        check_cwd(SELF, args.cwd)
-        print_pass("Looks like my working directory is correct!")
-
-    if args.parent_different_cwd:
-        print_test("My working directory should be different than the parent process'!")
-        print_info(f"My working directory is: {SELF.cwd()}.")
-        print_info(f"Parent working directory is: {PARENT.cwd()}.")
-        assert SELF.cwd() != PARENT.cwd(), "Parent process' and this process' working directories are the same!"
-        print_pass("Looks like my working directory is different than my parent's!")
-
-    if args.check_arg:
-        ns,v = args.check_arg.split(":")
-        n = int(ns)
-        print_test(f"My argv[{n}] should have a value of {v}! Let's check...")
-        check_arg(args.old_args[1:], n, v)
-        print_pass("You successfully passed the argument value check!")
-
-    if args.check_env:
-        k,v = args.check_env.split(":")
-        print_test(f"My '{k}' environment variable should have a value of {v}! Let's check...")
-        check_env(k, v)
-        print_pass("You successfully passed the environment value check!")
-
-    if args.empty_env:
-        print_test(f"You should launch me with an {'otherwise-' if args.check_env else ''}empty environment. Checking...")
-        check_env_count(1 if args.check_env else 0)
-        print_pass("You successfully passed the empty environment check!")
-
-    if args.empty_argv:
-        print_test("You should launch me with an empty argv (i.e., argc == 0). Checking...")
-        assert not args.old_args[1:], f"argv is not empty, but has {len(args.old_args[1:])} entries..."
-        print_pass("You successfully passed the empty argument check!")
-
-    if args.password:
-        print_test(f"This program expects you to enter a simple password (specifically, {args.password}). Send it now!")
-        check_password(args.password)
-        print_pass("You successfully passed the password!")
-
-    if args.num_challenges:
-        print_info(f"This program will send you {args.num_challenges} mathematical challenge{'s' if args.num_challenges>1 else ''} that you will need to compute responses for.")
-        check_challenges(args.num_challenges, args.challenge_ops, args.challenge_depth)
-        print_pass("You successfully passed the mathematical challenges!")
-
-    if args.num_signals:
-        print_info("This program will stop and wait for you to send it a number of signals. For more information on signals,")
-        print_info("look at the man page of the kill command.")
-        check_signals(args.num_signals)
-        print_pass("You successfully passed the signal challenges!")
+    plan = plan_checks(args)
+    if args.chio_schedule == "cost":
+        # cheap checks go first, so that most failing attempts never pay for the expensive ones
+        stages = [ [ c for c in plan if c[2] == cost ] for cost in sorted({ c[2] for c in plan }) ]
+    else:
+        stages = [ plan ]
+
+    context = { }
+    for stage in stages:
+        if "pipe_partners" not in context and any(name in PIPE_PARTNER_CHECKS for name,_,_ in stage):
+            context["pipe_partners"] = BackgroundCall(profiled, "pipe_partners", resolve_requested_pipe_partners, args)
+        run_stage(stage, args, context)
+
 #
 # Other stuff
 #
 
-def listen_dup(port):
+LISTEN_BACKLOG = 128
+
+def accept_sessions(s, max_sessions):
+    # forks off a session for each connection, and returns that connection in the session. the server itself only
+    # returns once a session succeeds, so a dropped or failed connection no longer ends the attempt.
+    #pylint:disable=global-statement
+    global SELF_PID, _stats_path
+    def session_ended(pid):
+        code = os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+        if code == 0:
+            sys.exit(0)
+        print_info(f"The session in PID {pid} ended without success (exit code {code}). Still listening for connections.")
+
+    sessions = { }
+    while True:
+        ready = wait_any_readable(list(sessions) + ([ s.fileno() ] if len(sessions) < max_sessions else [ ]), wait_deadline())
+        for pidfd in [ fd for fd in ready if fd in sessions ]:
+            pid = sessions.pop(pidfd)
+            os.close(pidfd)
+            session_ended(pid)
+
+        if s.fileno() not in ready:
+            continue
+        c,_ = s.accept()
+        flush_output()
+        pid = os.fork()
+        if pid == 0:
+            s.close()
+            for pidfd in sessions:
+                os.close(pidfd)
+            CHECKER_PIDS.add(SELF_PID)
+            SELF_PID = os.getpid()
+            return c
+        c.close()
+        # each session records its own attempt for --chio_stats
+        _stats_path = None
+        pidfd = pin_process(pid)
+        if pidfd is None:
+            # we can't wait on this session alongside the others (e.g., we're out of fds), so we wait for it right away
+            session_ended(pid)
+            continue
+        sessions[pidfd] = pid
+
+SD_LISTEN_FDS_START = 3
+
+def inherited_listen_socket():
+    # a socket that is already listening for us, passed in through systemd's LISTEN_FDS convention
+    if os.environ.get("LISTEN_PID") != str(SELF_PID):
+        return None
+    num_fds = int(os.environ.get("LISTEN_FDS", "0"))
+    # like sd_listen_fds(), we consume these, so that they don't show up in the environment checks
+    for var in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(var, None)
+    if num_fds < 1:
+        return None
+
+    s = socket.socket(fileno=SD_LISTEN_FDS_START)
+    assert (
+        s.family in (socket.AF_INET, socket.AF_INET6) and s.type == socket.SOCK_STREAM and
+        s.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN)
+    ), "The socket passed in through LISTEN_FDS is not a listening TCP socket."
+    return s
+
+def listen_dup(port, max_sessions=0, port_fd=-1):
+    s = inherited_listen_socket()
+    if s is None:
+        # port 0 gets us an ephemeral port, so that many attempts can run side by side
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('localhost', port))
+        s.listen(LISTEN_BACKLOG)
+    elif port and s.getsockname()[1] != port:
+        print_warn(f"Using the socket passed in through LISTEN_FDS, which is on port {s.getsockname()[1]} rather than {port}.")
+
+    port = s.getsockname()[1]
+    if port_fd != -1:
+        os.write(port_fd, f"{port}\n".encode())
     print_info(f"This challenge is a network server, and will only communicate on TCP port {port}.")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(('localhost', port))
-    s.listen()
-    c,_ = s.accept()
+    # sessions are waited on through pidfds, which older kernels don't have
+    probe = pin_process(os.getpid()) if max_sessions else None
+    if probe is not None:
+        os.close(probe)
+        print_info(f"Each connection gets its own session, and up to {max_sessions} sessions can run at once.")
+        c = accept_sessions(s, max_sessions)
+    else:
+        wait_readable(s.fileno(), wait_deadline())
+        c,_ = s.accept()
+        s.close()
     print_info("Connection received! All further communication will happen through the TCP connection.")
-    os.dup2(c.fileno(), 0)
-    os.dup2(c.fileno(), 1)
-    os.dup2(c.fileno(), 2)
+    flush_output()
+    for fd in (0, 1, 2):
+        os.dup2(c.fileno(), fd)
+        SELF_FDS[fd] = FdInfo(fd)
+    c.close()
 
 def input_dup(fd):
     print_test(f"This challenge takes input over {name_fd(fd)}! Make sure to provide this file descriptor to the program, and send any required input over it.")
-    assert os.path.exists(f"/proc/{os.getpid()}/fd/{fd}"), f"It looks like there is no {name_fd(fd)} passed in to this process."
+    assert fd in SELF_FDS, f"It looks like there is no {name_fd(fd)} passed in to this process."
+    flush_output()
     os.dup2(fd, 0)
+    SELF_FDS[0] = SELF_FDS[fd]
     print_pass("Preliminary checks are okay on the input FD!")
 
 def setup_input(args):
-    if args.listen_dup:
-        listen_dup(args.listen_dup)
+    if args.listen_dup is not None:
+        profiled("listen_dup", listen_dup, args.listen_dup, args.chio_listen_sessions, args.chio_port_fd)
 
     if args.input_dup:
-        input_dup(args.input_dup)
+        profiled("input_dup", input_dup, args.input_dup)
 
 ARG_HELP = { }
 def add_argument(parser, arg, **kwargs):
@@ -507,99 +1474,619 @@ def add_argument(parser, arg, **kwargs):
         ARG_HELP[arg[2:]] = kwargs['help']
     return parser.add_argument(arg, **kwargs)
 
-if __name__ == '__main__':
-    _parser = argparse.ArgumentParser()
+def build_parser():
+    parser = argparse.ArgumentParser()
 
     # process checks
-    add_argument(_parser, "--parent", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific parent process")
-    add_argument(_parser, "--client", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific (network) client process")
-    add_argument(_parser, "--check_stdin_pipe", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific process at the other end of stdin")
-    add_argument(_parser, "--check_stdout_pipe", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific process at the other end of stdout")
-    add_argument(_parser, "--check_stderr_pipe", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific process at the other end of stderr")
-    add_argument(_parser, "--check_stdin_parent", action='store_true', help="the challenge makes sure the parent is communicating with us over stdin")
-    add_argument(_parser, "--check_stdout_parent", action='store_true', help="the challenge makes sure the parent is communicating with us over stdout")
+    add_argument(parser, "--parent", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific parent process")
+    add_argument(parser, "--client", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific (network) client process")
+    add_argument(parser, "--check_stdin_pipe", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific process at the other end of stdin")
+    add_argument(parser, "--check_stdout_pipe", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific process at the other end of stdout")
+    add_argument(parser, "--check_stderr_pipe", choices=list(PROCESS_TYPE_CHECKERS.keys()), nargs='?', help="the challenge checks for a specific process at the other end of stderr")
+    add_argument(parser, "--check_stdin_parent", action='store_true', help="the challenge makes sure the parent is communicating with us over stdin")
+    add_argument(parser, "--check_stdout_parent", action='store_true', help="the challenge makes sure the parent is communicating with us over stdout")
 
     # i/o
-    add_argument(_parser, "--listen_dup", type=int, nargs='?', help="the challenge will listen for input on a TCP port")
-    add_argument(_parser, "--input_dup", type=int, nargs='?', help="the challenge will take input on a specific file descriptor")
-    add_argument(_parser, "--check_stdin_path", type=str, nargs='?', help="the challenge will check that input is redirected from a specific file path")
-    add_argument(_parser, "--check_stdout_path", type=str, nargs='?', help="the challenge will check that output is redirected to a specific file path")
-    add_argument(_parser, "--check_stderr_path", type=str, nargs='?', help="the challenge will check that error output is redirected to a specific file path")
-    add_argument(_parser, "--check_stdin_fifo", action='store_true', help="the challenge will make sure that stdin is redirected from a fifo")
-    add_argument(_parser, "--check_stdout_fifo", action='store_true', help="the challenge will make sure that stdout is redirected to a fifo")
+    add_argument(parser, "--listen_dup", type=int, nargs='?', const=0, help="the challenge will listen for input on a TCP port (0 for any free port)")
+    add_argument(parser, "--input_dup", type=int, nargs='?', help="the challenge will take input on a specific file descriptor")
+    add_argument(parser, "--check_stdin_path", type=str, nargs='?', help="the challenge will check that input is redirected from a specific file path")
+    add_argument(parser, "--check_stdout_path", type=str, nargs='?', help="the challenge will check that output is redirected to a specific file path")
+    add_argument(parser, "--check_stderr_path", type=str, nargs='?', help="the challenge will check that error output is redirected to a specific file path")
+    add_argument(parser, "--check_stdin_fifo", action='store_true', help="the challenge will make sure that stdin is redirected from a fifo")
+    add_argument(parser, "--check_stdout_fifo", action='store_true', help="the challenge will make sure that stdout is redirected to a fifo")
 
     # other process stuff
-    add_argument(_parser, "--cwd", type=str, nargs='?', help="the challenge will check that it is running in a specific current working directory")
-    add_argument(_parser, "--parent_different_cwd", action='store_true', help="the challenge will check to make sure that the parent's parent CWD to be different than the challenge's CWD")
-    add_argument(_parser, "--empty_env", action='store_true', help="the challenge will check that the environment is empty (except LC_CTYPE, which is impossible to get rid of in some cases)")
-    add_argument(_parser, "--empty_argv", action='store_true', help="the challenge will check that argv is empty (e.g., argc == 0)")
+    add_argument(parser, "--cwd", type=str, nargs='?', help="the challenge will check that it is running in a specific current working directory")
+    add_argument(parser, "--parent_different_cwd", action='store_true', help="the challenge will check to make sure that the parent's parent CWD to be different than the challenge's CWD")
+    add_argument(parser, "--empty_env", action='store_true', help="the challenge will check that the environment is empty (except LC_CTYPE, which is impossible to get rid of in some cases)")
+    add_argument(parser, "--empty_argv", action='store_true', help="the challenge will check that argv is empty (e.g., argc == 0)")
 
     # arg stuff
-    add_argument(_parser, "--check_arg", type=str, nargs='?', help="the challenge will check that argv[NUM] holds value VALUE (listed to the right as NUM:VALUE)")
-    add_argument(_parser, "--check_env", type=str, nargs='?', help="the challenge will check that env[KEY] holds value VALUE (listed to the right as KEY:VALUE)")
+    add_argument(parser, "--check_arg", type=str, nargs='?', help="the challenge will check that argv[NUM] holds value VALUE (listed to the right as NUM:VALUE)")
+    add_argument(parser, "--check_env", type=str, nargs='?', help="the challenge will check that env[KEY] holds value VALUE (listed to the right as KEY:VALUE)")
 
     # challenges
-    add_argument(_parser, "--num_challenges", type=int, nargs='?', help="the challenge will force the parent process to solve a number of arithmetic problems")
-    add_argument(_parser, "--challenge_ops", type=str, default="+", nargs='?', help="the challenge will use the following arithmetic operations in its arithmetic problems")
-    add_argument(_parser, "--challenge_depth", type=int, default=1, nargs='?', help="the complexity (in terms of nested expressions) of the arithmetic problems")
-    add_argument(_parser, "--password", type=str, nargs='?', help="the challenge will check for a hardcoded password over stdin")
-    add_argument(_parser, "--num_signals", type=int, nargs='?', help="the challenge will require the parent to send number of signals")
-    add_argument(_parser, "--reward", type=str, nargs='?', help="the challenge will output a reward file if all the tests pass")
+    add_argument(parser, "--num_challenges", type=int, nargs='?', help="the challenge will force the parent process to solve a number of arithmetic problems")
+    add_argument(parser, "--challenge_ops", type=str, default="+", nargs='?', help="the challenge will use the following arithmetic operations in its arithmetic problems")
+    add_argument(parser, "--challenge_depth", type=int, default=1, nargs='?', help="the complexity (in terms of nested expressions) of the arithmetic problems")
+    add_argument(parser, "--challenge_batch", type=int, nargs='?', help="the challenge will send its arithmetic problems in batches of this size, verifying responses as they arrive")
+    add_argument(parser, "--challenge_bank", type=str, nargs='?', help="the challenge will draw its arithmetic problems from a precomputed challenge bank file")
+    add_argument(parser, "--build_challenge_bank", action='store_true', help="build (or extend) the challenge bank for the given ops and depth, verify it, and exit")
+    add_argument(parser, "--challenge_bank_size", type=int, default=10000, help="the number of challenges to bank for each depth")
+    add_argument(parser, "--build_launchers", type=str, nargs='?', help="validate the level manifest, write a launcher for each level (and symlinks for its variants) into this directory, and exit")
+    add_argument(parser, "--build_zipapp", type=str, nargs='?', help="write a single-file, precompiled build of chio to this path, and exit")
+    add_argument(parser, "--password", type=str, nargs='?', help="the challenge will check for a hardcoded password over stdin")
+    add_argument(parser, "--num_signals", type=int, nargs='?', help="the challenge will require the parent to send number of signals")
+    add_argument(parser, "--reward", type=str, nargs='?', help="the challenge will output a reward file if all the tests pass")
 
     # chio behaviors
     #pylint:disable=consider-using-with
-    add_argument(_parser, "--chio_info_fd", type=int, default=2, help="file to write info to (-1 to disable)")
-    add_argument(_parser, "--chio_warn_fd", type=int, default=2, help="file to write warnings to (-1 to disable)")
-    add_argument(_parser, "--chio_hint_fd", type=int, default=2, help="file to write hints to (-1 to disable)")
-    add_argument(_parser, "--chio_test_fd", type=int, default=2, help="file to write things we're about to test to (-1 to disable)")
-    add_argument(_parser, "--chio_pass_fd", type=int, default=2, help="file to write pass messages to (-1 to disable)")
-    add_argument(_parser, "--chio_fail_fd", type=int, default=2, help="file to write fail messages to (-1 to disable)")
-    add_argument(_parser, "--chio_flag_fd", type=int, default=2, help="file to write the flag to (-1 to disable)")
-    add_argument(_parser, "--chio_hype_fd", type=int, default=2, help="file to write hype to (-1 to disable)")
-
+    add_argument(parser, "--chio_info_fd", type=int, default=2, help="file to write info to (-1 to disable)")
+    add_argument(parser, "--chio_warn_fd", type=int, default=2, help="file to write warnings to (-1 to disable)")
+    add_argument(parser, "--chio_hint_fd", type=int, default=2, help="file to write hints to (-1 to disable)")
+    add_argument(parser, "--chio_test_fd", type=int, default=2, help="file to write things we're about to test to (-1 to disable)")
+    add_argument(parser, "--chio_pass_fd", type=int, default=2, help="file to write pass messages to (-1 to disable)")
+    add_argument(parser, "--chio_fail_fd", type=int, default=2, help="file to write fail messages to (-1 to disable)")
+    add_argument(parser, "--chio_flag_fd", type=int, default=2, help="file to write the flag to (-1 to disable)")
+    add_argument(parser, "--chio_hype_fd", type=int, default=2, help="file to write hype to (-1 to disable)")
+    add_argument(parser, "--chio_format", choices=[ "text", "jsonl" ], default="text", help="write messages as text, or as one JSON record (with a type and a message) per line")
+    add_argument(parser, "--chio_profile", type=int, help="file to write the wall clock and cpu time of each step, and counts of the work (e.g., /proc reads) done, to at exit")
+    add_argument(parser, "--chio_partner_timeout", type=float, default=3, help="how many seconds to wait for the processes on the other end of stdout/stderr pipes to show up")
+    add_argument(parser, "--chio_signal_mode", choices=[ "sigwait", "handler" ], default="sigwait", help="wait for signals synchronously with sigwaitinfo(), or with signal handlers")
+    add_argument(parser, "--chio_binary_cache", type=str, help="file in which to remember the results of binary checks across runs")
+    add_argument(parser, "--chio_binary_cache_size", type=int, default=64, help="the maximum number of binaries to remember in the binary check cache")
+    add_argument(parser, "--chio_schedule", choices=[ "plan", "cost" ], default="plan", help="run the checks in their reporting order, or the cheapest checks first")
+    add_argument(parser, "--chio_step_timeout", type=float, help="how many seconds to wait for each interaction (a line of input, a connection, or a signal) before exiting with code 3")
+    add_argument(parser, "--chio_session_timeout", type=float, help="how many seconds the whole attempt may take before exiting with code 3")
+    add_argument(parser, "--chio_listen_sessions", type=int, default=0, help="with --listen_dup, how many connections to check at once, each in its own session, until one succeeds (0 to check only the first connection)")
+    add_argument(parser, "--chio_port_fd", type=int, default=-1, help="file to write the TCP port that --listen_dup listens on to (-1 to disable)")
+    add_argument(parser, "--chio_level", type=str, help="take the challenge's arguments from this level in the level manifest (arguments given here override them)")
+    add_argument(parser, "--chio_manifest", type=str, default=DEFAULT_MANIFEST, help="the level manifest to use with --chio_level and --build_launchers")
+    add_argument(parser, "--chio_serve", type=str, help="run as a service on this unix socket, checking the launchers (each built for a level in the --chio_manifest) that connect to it instead of ourselves")
+    add_argument(parser, "--chio_stats", type=str, help="file to append a record of each attempt (the outcome and duration of each check, and the exit code) to")
+    add_argument(parser, "--chio_stats_rollup", type=str, help="roll the --chio_stats records up into this Prometheus textfile, and exit")
+    add_argument(parser, "--chio_stats_max_size", type=int, default=64*1024*1024, help="how many bytes the --chio_stats file may grow to before a rollup rotates it")
+    add_argument(parser, "--chio_scan_scope", choices=[ "all", "pidns", "cgroup", "uid" ], default="all", help="only look for pipe and socket partners in our pid namespace, cgroup, or uid")
 
     # remaining arguments
-    _parser.add_argument("old_args", nargs=argparse.REMAINDER)
-
-    _args = _parser.parse_args()
+    parser.add_argument("old_args", nargs=argparse.REMAINDER)
+    return parser
 
-    assert (not _args.old_args) or _args.old_args[0] == "--", "ERROR: INVALID OLD_ARGV. Contact the profs."
-
-    print_info("WELCOME! This challenge makes the following asks of you:")
-    for _a,_v in vars(_args).items():
-        if _a == 'old_args':
+def level_asks(args):
+    # yields the (argument, value) pairs that make up what the level asks of the student
+    for a,v in vars(args).items():
+        if a == 'old_args':
+            continue
+        if a.startswith("chio"):
             continue
-        if _a.startswith("chio"):
+        if v is None or v is False:
             continue
-        if _v in ( None, False ):
+        if a in [ "challenge_ops", "challenge_depth", "challenge_batch", "challenge_bank" ] and not args.num_challenges:
             continue
-        if _a in [ "challenge_ops", "challenge_depth" ] and not _args.num_challenges:
+        if a in [ "build_challenge_bank", "challenge_bank_size", "build_launchers", "build_zipapp" ]:
             continue
-        if _v is True:
-            print_info("-", ARG_HELP[_a])
+        yield a, v
+
+def run_attempt(args):
+    # returns the exit code
+    #pylint:disable=global-statement
+    global _session_deadline, _profile, _profile_counts, _stats_path
+    if args.chio_session_timeout:
+        _session_deadline = time.monotonic() + args.chio_session_timeout
+    if args.chio_profile is not None:
+        _profile = Profile(args.chio_profile)
+        if _profile_counts is None:
+            _profile_counts = { }
+    if args.chio_stats:
+        _stats_path = args.chio_stats
+        if _profile is None:
+            _profile = Profile(-1)
+
+    assert (not args.old_args) or args.old_args[0] == "--", "ERROR: INVALID OLD_ARGV. Contact the profs."
+
+    print_info("WELCOME! This challenge makes the following asks of you:")
+    for a,v in level_asks(args):
+        if v is True:
+            print_info("-", ARG_HELP[a])
         else:
-            print_info("-", ARG_HELP[_a],":",_v)
+            print_info("-", ARG_HELP[a],":",v)
 
     print_hype("ONWARDS TO GREATNESS!")
 
     try:
-        setup_input(_args)
-    except AssertionError as _e:
+        setup_input(args)
+    except AssertionError as e:
         print_fail("You did not satisfy all the execution requirements.")
         print_fail("Specifically, you must fix the following issue:")
-        print_fail(f"  {_e}")
-        sys.exit(1)
+        print_fail(f"  {e}")
+        return 1
+    except SessionTimeout:
+        print_fail("You took too long to interact with this challenge. Exiting.")
+        return 3
 
     try:
-        do_checks(_args)
-    except AssertionError as _e:
+        do_checks(args)
+    except AssertionError as e:
         print_fail("You did not satisfy all the execution requirements.")
         print_fail("Specifically, you must fix the following issue:")
-        print_fail(f"  {_e}")
-        sys.exit(2)
+        print_fail(f"  {e}")
+        return 2
+    except SessionTimeout:
+        print_fail("You took too long to interact with this challenge. Exiting.")
+        return 3
 
     print_pass("Success! You have satisfied all execution requirements.")
-    if _args.reward:
+    if args.reward:
         print_flag("Here is your flag:")
-        print_flag(open(_args.reward).read()) #pylint:disable=unspecified-encoding,consider-using-with
-    sys.exit(0)
+        print_flag(open(args.reward).read()) #pylint:disable=unspecified-encoding,consider-using-with
+    return 0
+
+#
+# Levels
+#
+
+# every level's arguments, along with the checks they should result in, so that mistakes are caught when the launchers
+# are built rather than when students run them
+# this sits next to chio.py, or next to the zipapp that chio.py is imported from
+DEFAULT_MANIFEST = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)) if os.path.isfile(os.path.realpath(__file__)) else os.path.dirname(os.path.dirname(__file__)),
+    "levels.json"
+)
+
+# launchers are built without libc (and so without any glibc symbol versions), so that they run in the challenge
+# image no matter which glibc they were built against
+LAUNCHER_TEMPLATE = """// generated by chio.py --build_launchers from {manifest}; do not edit
+static char *chio_argv[] = {{ {chio_argv}, 0 }};
+#define CHIO_ARGC ((int)(sizeof(chio_argv) / sizeof(chio_argv[0])) - 1)
+
+__attribute__((used, noreturn)) static void launch(long *stack)
+{{
+	int argc = stack[0];
+	char **argv = (char **)(stack + 1);
+	char **envp = argv + argc + 1;
+	char *args[CHIO_ARGC + argc + 1];
+	for (int i = 0; i < CHIO_ARGC; i++) args[i] = chio_argv[i];
+	for (int i = 0; i < argc; i++) args[CHIO_ARGC + i] = argv[i];
+	args[CHIO_ARGC + argc] = 0;
+	long ret;
+	__asm__ volatile ("syscall" : "=a"(ret) : "a"(59), "D"(args[0]), "S"(args), "d"(envp) : "rcx", "r11", "memory");
+	__asm__ volatile ("syscall" : : "a"(60), "D"(1) : "rcx", "r11", "memory");
+	__builtin_unreachable();
+}}
+
+__asm__(".globl _start\\n_start:\\n\\txor %rbp, %rbp\\n\\tmov %rsp, %rdi\\n\\tand $-16, %rsp\\n\\tcall launch\\n");
+"""
+# the newest glibc symbol version that a launcher may need: that of the Ubuntu 20.04 based challenge image
+LAUNCHER_MAX_GLIBC = (2, 31)
+SHT_GNU_VERNEED = 0x6ffffffe
+
+def elf_needed_versions(elf):
+    # returns the symbol versions (e.g., GLIBC_2.34) that the ELF needs from its shared libraries
+    shoff, = struct.unpack_from("<Q", elf, 0x28)
+    shentsize, shnum = struct.unpack_from("<HH", elf, 0x3a)
+    sections = [ struct.unpack_from("<IIQQQQIIQQ", elf, shoff + i*shentsize) for i in range(shnum) ]
+
+    versions = set()
+    for _, sh_type, _, _, sh_offset, _, sh_link, _, _, _ in sections:
+        if sh_type != SHT_GNU_VERNEED:
+            continue
+        strtab_offset = sections[sh_link][4]
+        verneed = sh_offset
+        while True:
+            _, vn_cnt, _, vn_aux, vn_next = struct.unpack_from("<HHIII", elf, verneed)
+            vernaux = verneed + vn_aux
+            for _ in range(vn_cnt):
+                _, _, _, vna_name, vna_next = struct.unpack_from("<IHHII", elf, vernaux)
+                versions.add(elf[strtab_offset + vna_name:elf.index(b"\0", strtab_offset + vna_name)].decode())
+                vernaux += vna_next
+            if not vn_next:
+                break
+            verneed += vn_next
+    return versions
+
+def load_manifest(path):
+    with open(path) as f: #pylint:disable=unspecified-encoding
+        return json.load(f)
+
+def validate_level(level_id, level):
+    args = build_parser().parse_args(level["args"])
+    assert not args.old_args, f"ERROR: LEVEL {level_id} PASSES ARGUMENTS FOR THE STUDENT. Contact the profs."
+    plan = [ name for name,_,_ in plan_checks(args) ]
+    if plan != level["plan"]:
+        raise RuntimeError(f"Level {level_id} should check {level['plan']}, but its arguments check {plan}. Please report this; it is not your fault.")
+
+def load_level(manifest_path, level_id):
+    levels = load_manifest(manifest_path)["levels"]
+    assert level_id in levels, f"ERROR: UNKNOWN LEVEL {level_id}. Contact the profs."
+    validate_level(level_id, levels[level_id])
+    return levels[level_id]["args"]
+
+def parse_args(argv):
+    args = build_parser().parse_args(argv)
+    if args.chio_level:
+        args = build_parser().parse_args(load_level(args.chio_manifest, args.chio_level) + argv)
+    return args
+
+def compile_launcher(argv, path, manifest_path):
+    # json string escapes are valid C string escapes
+    source = LAUNCHER_TEMPLATE.format(manifest=os.path.basename(manifest_path), chio_argv=", ".join(json.dumps(a) for a in argv))
+    count("subprocesses")
+    subprocess.run(
+        [
+            "gcc", "-Os", "-s", "-static", "-nostdlib", "-no-pie", "-fno-stack-protector", "-fno-tree-loop-distribute-patterns",
+            "-Wl,-z,noseparate-code", "-o", path, "-x", "c", "-"
+        ],
+        input=source.encode(), check=True
+    )
+    with open(path, "rb") as f:
+        versions = elf_needed_versions(f.read())
+    too_new = [ v for v in versions if v.startswith("GLIBC_") and tuple(int(n) for n in v[6:].split(".")) > LAUNCHER_MAX_GLIBC ]
+    assert not too_new, f"ERROR: THE LAUNCHER AT {path} NEEDS {', '.join(sorted(too_new))}, WHICH THE CHALLENGE IMAGE DOES NOT HAVE."
+
+def build_launchers(manifest_path, out_dir):
+    # levels (and their variants) with the same arguments share one launcher, and every variant's chio.py is the one
+    # precompiled zipapp, so that what the launchers run is always built alongside them
+    manifest = load_manifest(manifest_path)
+    os.makedirs(out_dir, exist_ok=True)
+    app = os.path.join(out_dir, "chio.pyz")
+    build_zipapp(app)
+    built = { }
+    for level_id, level in manifest["levels"].items():
+        validate_level(level_id, level)
+        argv = [ manifest["chio"] ] + level["args"] + [ "--" ]
+        level_dir = os.path.join(out_dir, level_id)
+        os.makedirs(level_dir, exist_ok=True)
+        launcher = os.path.join(level_dir, "run")
+        if os.path.lexists(launcher):
+            os.unlink(launcher)
+        if tuple(argv) in built:
+            os.symlink(os.path.relpath(built[tuple(argv)], level_dir), launcher)
+        else:
+            compile_launcher(argv, launcher, manifest_path)
+            built[tuple(argv)] = launcher
+
+        for variant in range(level["variants"]):
+            variant_dir = os.path.join(level_dir, f"_{variant}")
+            os.makedirs(variant_dir, exist_ok=True)
+            for name, target in [ ("run", "../run"), ("chio.py", os.path.relpath(app, variant_dir)) ]:
+                if os.path.lexists(os.path.join(variant_dir, name)):
+                    os.unlink(os.path.join(variant_dir, name))
+                os.symlink(target, os.path.join(variant_dir, name))
+
+    print_info(f"Built {len(built)} launchers for {len(manifest['levels'])} levels in {out_dir}.")
+
+#
+# Service mode
+#
+
+# a launcher sends the sizes of its level id and argv and the number of its open fds (all below SESSION_FD_MIN), along
+# with those fds, and then their fd numbers, its level id, and its argv as NUL-terminated strings. the level's checks
+# come from our level manifest, and the launcher's argv is only ever the student's argv (after the "--"), so a
+# (setuid) launcher can't be used to pick which checks run, which file is the reward, or any of our own options.
+# we reply with a byte of LAUNCH_* flags, after which the launcher forwards the signals it catches as
+# (signal, sender pid) records if we asked for them, and finally the exit code as a single byte.
+LAUNCH_HEADER = struct.Struct("=III")
+# SCM_MAX_FD: the most fds that one message can carry
+LAUNCH_MAX_FDS = 253
+LAUNCH_FORWARD_SIGNALS = 1
+SIGNAL_RECORD = struct.Struct("=Bi")
+# fds that we have received, but not yet put in place, are kept out of the way up here. launched fds must be below it.
+SESSION_FD_MIN = 512
+
+_session_socket = None
+
+def receive_launcher_fds(conn):
+    # mirrors the launcher's fds onto ours, returning the sizes of the level id and argv that follow
+    header, fds, _, _ = socket.recv_fds(conn, LAUNCH_HEADER.size, LAUNCH_MAX_FDS, socket.MSG_WAITALL)
+    assert len(header) == LAUNCH_HEADER.size, "ERROR: TRUNCATED LAUNCH HEADER. Contact the profs."
+    level_size, argv_size, num_fds = LAUNCH_HEADER.unpack(header)
+
+    received = [ ]
+    for fd in fds:
+        received.append(fcntl.fcntl(fd, fcntl.F_DUPFD_CLOEXEC, SESSION_FD_MIN))
+        os.close(fd)
+    targets = list(struct.unpack(f"={num_fds}I", conn.recv(4 * num_fds, socket.MSG_WAITALL))) if num_fds else [ ]
+    assert len(targets) == len(received) == num_fds, "ERROR: LAUNCH FD MISMATCH. Contact the profs."
+    assert all(fd < SESSION_FD_MIN for fd in targets), "ERROR: LAUNCH FD OUT OF RANGE. Contact the profs."
+
+    for fd in range(SESSION_FD_MIN):
+        if fd in targets:
+            os.dup2(received[targets.index(fd)], fd)
+        else:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+    for fd in received:
+        os.close(fd)
+    return level_size, argv_size
+
+def read_proc_environ(pid):
+    with open(f"/proc/{pid}/environ", "rb") as f:
+        entries = f.read().split(b"\0")
+    return dict(e.decode(errors="replace").split("=", 1) for e in entries if b"=" in e)
+
+def serve_session(conn, manifest_path):
+    # runs in a fork()ed child of the service, and returns the exit code for the launcher
+    #pylint:disable=global-statement
+    global _args, _session_socket, _launcher_pidfd, _started, _profile_counts, SELF_PID, PARENT_PID, SELF_FDS, STARTUP_PARTNERS
+
+    pid, uid, _ = struct.unpack("=iII", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, 12))
+    # only the (privileged) launchers get to have their checks run, since they get to see the reward
+    if uid != os.geteuid():
+        return 1
+
+    # serve() ignores SIGCHLD, but --chio_listen_sessions needs to wait on its sessions
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    session_pid = os.getpid()
+
+    _session_socket = socket.socket(fileno=fcntl.fcntl(conn.fileno(), fcntl.F_DUPFD_CLOEXEC, SESSION_FD_MIN))
+    conn.close()
+    level_size, argv_size = receive_launcher_fds(_session_socket)
+    level_id = _session_socket.recv(level_size, socket.MSG_WAITALL).decode(errors="replace")
+    argv = [ a.decode(errors="replace") for a in _session_socket.recv(argv_size, socket.MSG_WAITALL).split(b"\0")[:-1] ]
+    _started = (time.perf_counter(), time.process_time())
+
+    SELF_PID = pid
+    CHECKER_PIDS.update({ os.getpid(), os.getppid() })
+    SELF_FDS = { fd: info for fd,info in snapshot_fds().items() if fd < SESSION_FD_MIN }
+    _launcher_pidfd = pin_process(pid)
+    PARENT_PID = read_proc_stat(pid)[1]
+    # these were recorded for the service itself, and there's no launch race left to cover for the launcher
+    STARTUP_PARTNERS = { }
+    os.environ.clear()
+    os.environ.update(read_proc_environ(pid))
+    os.chdir(f"/proc/{pid}/cwd")
+
+    try:
+        level_args = load_level(manifest_path, level_id)
+        _profile_counts = { } if profiling_requested(level_args) else None
+        _args = parse_args(level_args + [ "--" ] + argv)
+    except (AssertionError, RuntimeError) as e:
+        print_fail(e)
+        flush_output_at_exit()
+        _session_socket.sendall(bytes([ 0, 1 ]))
+        return 1
+    _args.chio_signal_mode = "proxy"
+    _session_socket.sendall(bytes([ LAUNCH_FORWARD_SIGNALS if _args.num_signals else 0 ]))
+
+    try:
+        code = run_attempt(_args)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except AssertionError as e:
+        print_fail(e)
+        code = 1
+    record_attempt(_args, code)
+    flush_output_at_exit()
+    report_profile()
+    # sessions fork()ed off by --chio_listen_sessions report to the session that forked them, rather than to the launcher
+    if os.getpid() == session_pid:
+        _session_socket.sendall(bytes([ code ]))
+    return code
+
+def serve(path, manifest_path):
+    # everything is imported and set up once, and each connecting launcher is checked by a fork()ed copy of us
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    if os.path.exists(path) and stat.S_ISSOCK(os.lstat(path).st_mode):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o666)
+    server.listen(128)
+    print_info(f"Serving checks on {path}.")
+    flush_output()
+
+    while True:
+        conn,_ = server.accept()
+        if os.fork() == 0:
+            code = 1
+            try:
+                server.close()
+                code = serve_session(conn, manifest_path)
+            finally:
+                os._exit(code)
+        conn.close()
+
+#
+# Fleet stats
+#
+
+# Each attempt appends a one-line JSON record to the --chio_stats file with a single O_APPEND write(), which the kernel
+# never interleaves with other writes to the same file, so any number of attempts can share the file without locking.
+# A rollup (run periodically, e.g., from cron) reads the records added since the last rollup into cumulative
+# histograms, which it keeps next to the stats file and writes out for Prometheus' textfile collector.
+
+_stats_path = None
+STATS_BUCKETS = [ 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300 ]
+
+def record_attempt(args, code):
+    #pylint:disable=global-statement
+    global _stats_path
+    if _stats_path is None or _profile is None:
+        return
+    path, _stats_path = _stats_path, None
+
+    record = {
+        "time": round(time.time(), 3),
+        "level": args.chio_level,
+        "flags": " ".join(f"--{a}" for a,_ in level_asks(args)),
+        "checks": [ [ name, outcome, round(wall, 6) ] for name,wall,_,outcome in _profile.steps ],
+        "duration": round(time.perf_counter() - _started[0], 6),
+        "exit": code,
+    }
+    try:
+        # we may be running setuid with the student's umask, which can only take permissions away from these
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            os.write(fd, (json.dumps(record, separators=(",", ":")) + "\n").encode())
+        finally:
+            os.close(fd)
+    except OSError:
+        # the stats are for us, and aren't worth failing anyone's attempt over
+        pass
+
+def valid_stats_record(record):
+    # the stats file is only ever appended to by us, but a bad line must never wedge every later rollup
+    number = (int, float)
+    return (
+        isinstance(record, dict) and isinstance(record.get("level"), (str, type(None))) and isinstance(record.get("flags"), str)
+        and isinstance(record.get("exit"), int) and isinstance(record.get("duration"), number) and isinstance(record.get("checks"), list)
+        and all(
+            isinstance(c, list) and len(c) == 3 and isinstance(c[0], str) and isinstance(c[1], str) and isinstance(c[2], number)
+            for c in record["checks"]
+        )
+    )
+
+def read_stats_records(path, offset):
+    # returns the complete, well-formed records after the offset, the number of malformed ones, and the offset after them
+    try:
+        with open(path, "rb") as f:
+            if offset > os.fstat(f.fileno()).st_size:
+                # the file was replaced behind our back
+                offset = 0
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [ ], 0, 0
+    data = data[:data.rfind(b"\n") + 1]
+    records = [ ]
+    malformed = 0
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if valid_stats_record(record):
+            records.append(record)
+        else:
+            malformed += 1
+    return records, malformed, offset + len(data)
+
+def observe(histograms, metric, labels, value):
+    histogram = histograms.setdefault(metric, { }).setdefault(labels, { "buckets": [ 0 ] * len(STATS_BUCKETS), "sum": 0, "count": 0 })
+    for i,bound in enumerate(STATS_BUCKETS):
+        if value <= bound:
+            histogram["buckets"][i] += 1
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+def prometheus_labels(**labels):
+    escaped = { k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k,v in labels.items() }
+    return ",".join(f'{k}="{v}"' for k,v in escaped.items())
+
+STATS_METRICS = {
+    "chio_attempt_duration_seconds": "How long attempts took, by level and exit code.",
+    "chio_check_duration_seconds": "How long each step of an attempt took, by level, step, and outcome.",
+}
+
+def rollup_stats(stats_path, out_path, max_size):
+    state_path = f"{stats_path}.rollup"
+    try:
+        with open(state_path) as f: #pylint:disable=unspecified-encoding
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = { "offset": 0, "histograms": { } }
+
+    try:
+        size = os.path.getsize(stats_path)
+    except FileNotFoundError:
+        size = 0
+    if size >= max_size:
+        # new records go to a fresh file from here on, and the rest of this one is rolled up and kept around as .1
+        rotated_path = f"{stats_path}.1"
+        os.replace(stats_path, rotated_path)
+        records, malformed, _ = read_stats_records(rotated_path, state["offset"])
+        state["offset"] = 0
+    else:
+        records, malformed, state["offset"] = read_stats_records(stats_path, state["offset"])
+
+    histograms = state["histograms"]
+    for record in records:
+        level = record["level"] or record["flags"]
+        observe(histograms, "chio_attempt_duration_seconds", prometheus_labels(level=level, exit=record["exit"]), record["duration"])
+        for name,outcome,duration in record["checks"]:
+            observe(histograms, "chio_check_duration_seconds", prometheus_labels(level=level, step=name, outcome=outcome), duration)
+
+    lines = [ ]
+    for metric,description in STATS_METRICS.items():
+        lines += [ f"# HELP {metric} {description}", f"# TYPE {metric} histogram" ]
+        for labels,histogram in sorted(histograms.get(metric, { }).items()):
+            for bound,n in zip(STATS_BUCKETS, histogram["buckets"]):
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {n}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{metric}_sum{{{labels}}} {histogram['sum']}")
+            lines.append(f"{metric}_count{{{labels}}} {histogram['count']}")
+
+    # the textfile collector could read the file at any time, so it is replaced in one go, and so is our state
+    for path,text in ((out_path, "\n".join(lines) + "\n"), (state_path, json.dumps(state))):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f: #pylint:disable=unspecified-encoding
+            f.write(text)
+        os.replace(tmp_path, path)
+    print_info(f"Rolled {len(records)} attempts up into {out_path}.")
+    if malformed:
+        print_warn(f"Skipped {malformed} malformed records.")
+
+#
+# Distribution
+#
+
+# a zipapp of chio, with chio precompiled: Python never caches the bytecode of the script it is asked to run, but it
+# does import precompiled modules straight out of a zipapp, so launching this skips compiling chio.py every time
+ZIPAPP_MAIN = "import chio\nchio.main()\n"
+
+def build_zipapp(path):
+    source_path = os.path.realpath(__file__)
+    with tempfile.TemporaryDirectory() as app_dir:
+        with open(os.path.join(app_dir, "__main__.py"), "w") as f: #pylint:disable=unspecified-encoding
+            f.write(ZIPAPP_MAIN)
+        shutil.copy(source_path, os.path.join(app_dir, "chio.py"))
+        # zipimport prefers chio.pyc, and falls back to chio.py if it was built by a different Python version
+        py_compile.compile(
+            source_path, cfile=os.path.join(app_dir, "chio.pyc"), dfile="chio.py", doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH
+        )
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        zipapp.create_archive(app_dir, tmp_path, interpreter="/usr/bin/python3 -I")
+        # create_archive only makes it executable by its owner
+        os.chmod(tmp_path, 0o755)
+        os.replace(tmp_path, path)
+    print_info(f"Built {path}.")
+
+def main():
+    #pylint:disable=global-statement
+    global _args
+    _args = parse_args(sys.argv[1:])
+
+    if _args.build_zipapp:
+        build_zipapp(_args.build_zipapp)
+        sys.exit(0)
+
+    if _args.build_launchers:
+        build_launchers(_args.chio_manifest, _args.build_launchers)
+        sys.exit(0)
+
+    if _args.build_challenge_bank:
+        assert _args.challenge_bank, "ERROR: --build_challenge_bank needs a --challenge_bank path."
+        build_challenge_bank(_args.challenge_bank, _args.challenge_ops, _args.challenge_depth, _args.challenge_bank_size)
+        sys.exit(0)
+
+    if _args.chio_stats_rollup:
+        assert _args.chio_stats, "ERROR: --chio_stats_rollup needs a --chio_stats path."
+        rollup_stats(_args.chio_stats, _args.chio_stats_rollup, _args.chio_stats_max_size)
+        sys.exit(0)
+
+    if _args.chio_serve:
+        serve(_args.chio_serve, _args.chio_manifest)
+
+    try:
+        code = run_attempt(_args)
+    except SystemExit as e:
+        record_attempt(_args, e.code if isinstance(e.code, int) else 1)
+        raise
+    record_attempt(_args, code)
+    sys.exit(code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+// A drop-in replacement for running /challenge/chio.py directly: it hands its fds, argv, and any signals it gets over
+// to a chio.py that is running as a service (--chio_serve), and exits with whatever code the checks come up with.
+// Each launcher is built for one level, whose checks the service takes from its level manifest; everything on our own
+// command line is only ever the student's argv.
+//
+//     gcc -O2 -o launcher launcher.c -DCHIO_SOCKET='"/run/chio.sock"' -DCHIO_LEVEL='"level-1"'
+
+#include <errno.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
+
+#ifndef CHIO_SOCKET
+#define CHIO_SOCKET "/run/chio.sock"
+#endif
+#ifndef CHIO_LEVEL
+#error "the launcher must be built for a level, e.g., with -DCHIO_LEVEL='\"level-1\"'"
+#endif
+
+// these must match LAUNCH_MAX_FDS, SESSION_FD_MIN, and LAUNCH_FORWARD_SIGNALS in chio.py
+#define LAUNCH_MAX_FDS 253
+#define SESSION_FD_MIN 512
+#define LAUNCH_FORWARD_SIGNALS 1
+
+static int chio_socket = -1;
+
+static void forward_signal(int signo, siginfo_t *info, void *context)
+{
+	unsigned char record[5];
+	(void)context;
+	record[0] = signo;
+	memcpy(record + 1, &info->si_pid, sizeof(int32_t));
+	if (write(chio_socket, record, sizeof(record)) < 0) _exit(1);
+}
+
+static int read_byte(int fd, unsigned char *byte)
+{
+	ssize_t n;
+	while ((n = read(fd, byte, 1)) < 0 && errno == EINTR);
+	return n == 1 ? 0 : -1;
+}
+
+static int write_all(int fd, const char *data, size_t size)
+{
+	while (size) {
+		ssize_t n = write(fd, data, size);
+		if (n < 0 && errno == EINTR) continue;
+		if (n <= 0) return -1;
+		data += n;
+		size -= n;
+	}
+	return 0;
+}
+
+int main(int argc, char **argv)
+{
+	struct sockaddr_un addr = { .sun_family = AF_UNIX };
+	strncpy(addr.sun_path, CHIO_SOCKET, sizeof(addr.sun_path) - 1);
+	int s = socket(AF_UNIX, SOCK_STREAM, 0);
+	if (s < 0 || connect(s, (struct sockaddr *)&addr, sizeof(addr)) < 0) {
+		perror("ERROR: could not connect to the chio service");
+		return 1;
+	}
+	// keep our own socket out of the fds that get checked
+	chio_socket = fcntl(s, F_DUPFD_CLOEXEC, SESSION_FD_MIN);
+	close(s);
+	if (chio_socket < 0) {
+		perror("ERROR: could not connect to the chio service");
+		return 1;
+	}
+
+	int fds[LAUNCH_MAX_FDS];
+	uint32_t num_fds = 0;
+	for (int fd = 0; fd < SESSION_FD_MIN; fd++) {
+		if (fcntl(fd, F_GETFD) < 0) continue;
+		if (num_fds == LAUNCH_MAX_FDS) {
+			fprintf(stderr, "ERROR: you have too many open file descriptors (at most %d are supported).\n", LAUNCH_MAX_FDS);
+			return 1;
+		}
+		fds[num_fds++] = fd;
+	}
+	uint32_t fd_numbers[LAUNCH_MAX_FDS];
+	for (uint32_t i = 0; i < num_fds; i++) fd_numbers[i] = fds[i];
+
+	uint32_t argv_size = 0;
+	for (int i = 0; i < argc; i++) argv_size += strlen(argv[i]) + 1;
+	char *argv_data = malloc(argv_size);
+	if (!argv_data) return 1;
+	for (int i = 0, offset = 0; i < argc; i++) {
+		memcpy(argv_data + offset, argv[i], strlen(argv[i]) + 1);
+		offset += strlen(argv[i]) + 1;
+	}
+
+	uint32_t level_size = strlen(CHIO_LEVEL);
+	char header[12];
+	memcpy(header, &level_size, 4);
+	memcpy(header + 4, &argv_size, 4);
+	memcpy(header + 8, &num_fds, 4);
+	char control[CMSG_SPACE(sizeof(fds))];
+	memset(control, 0, sizeof(control));
+	struct iovec iov = { .iov_base = header, .iov_len = sizeof(header) };
+	struct msghdr msg = { .msg_iov = &iov, .msg_iovlen = 1 };
+	if (num_fds) {
+		msg.msg_control = control;
+		msg.msg_controllen = CMSG_SPACE(num_fds * sizeof(int));
+		struct cmsghdr *cmsg = CMSG_FIRSTHDR(&msg);
+		cmsg->cmsg_level = SOL_SOCKET;
+		cmsg->cmsg_type = SCM_RIGHTS;
+		cmsg->cmsg_len = CMSG_LEN(num_fds * sizeof(int));
+		memcpy(CMSG_DATA(cmsg), fds, num_fds * sizeof(int));
+	}
+	if (
+		sendmsg(chio_socket, &msg, 0) != sizeof(header) ||
+		write_all(chio_socket, (char *)fd_numbers, num_fds * sizeof(uint32_t)) < 0 ||
+		write_all(chio_socket, CHIO_LEVEL, level_size) < 0 ||
+		write_all(chio_socket, argv_data, argv_size) < 0
+	) {
+		perror("ERROR: could not talk to the chio service");
+		return 1;
+	}
+
+	// the service tells us whether the level has the student send us signals, in which case we pass them along
+	unsigned char flags, code;
+	if (read_byte(chio_socket, &flags) < 0) {
+		fprintf(stderr, "ERROR: the chio service went away. Please report this; it is not your fault.\n");
+		return 1;
+	}
+	if (flags & LAUNCH_FORWARD_SIGNALS) {
+		struct sigaction sa = { .sa_sigaction = forward_signal, .sa_flags = SA_SIGINFO | SA_RESTART };
+		int signals[] = { SIGUSR1, SIGUSR2, SIGINT, SIGABRT, SIGHUP };
+		for (size_t j = 0; j < sizeof(signals) / sizeof(signals[0]); j++) sigaction(signals[j], &sa, NULL);
+	}
+
+	if (read_byte(chio_socket, &code) < 0) {
+		fprintf(stderr, "ERROR: the chio service went away. Please report this; it is not your fault.\n");
+		return 1;
+	}
+	return code;
+}
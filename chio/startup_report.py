@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# Reports how quickly chio starts up, and how much memory it uses, for each combination of flags used by the levels in
+# the level manifest. Each run gets /dev/null as its stdin and a short session timeout, so that the interactive checks
+# fail (or time out) instead of waiting on us.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+
+CHIO = os.path.join(os.path.dirname(os.path.realpath(__file__)), "chio.py")
+
+def flag_combinations(manifest_path):
+    # { the level's flags, without their values: the first level that uses them }
+    combinations = { }
+    with open(manifest_path) as f: #pylint:disable=unspecified-encoding
+        levels = json.load(f)["levels"]
+    for level in levels.values():
+        flags = " ".join(a for a in level["args"] if a.startswith("--") and a != "--reward")
+        combinations.setdefault(flags, level["args"])
+    return combinations
+
+def measure(chio, args, timeout):
+    # returns (seconds until the first output, seconds until exit, peak rss in KB, exit code)
+    # chio is run through its own #! line, the same way the launchers run it
+    argv = [ chio ] + args + [ "--reward", "/dev/null", "--chio_session_timeout", str(timeout) ]
+    start = time.perf_counter()
+    with subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as p:
+        p.stderr.read(1)
+        first_output = time.perf_counter() - start
+        p.stderr.read()
+        _, status, rusage = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+    return first_output, time.perf_counter() - start, rusage.ru_maxrss, p.returncode
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chio", default=CHIO, help="the chio.py to measure")
+    parser.add_argument("--manifest", default=os.path.join(os.path.dirname(CHIO), "levels.json"), help="the level manifest to take flag combinations from")
+    parser.add_argument("--runs", type=int, default=5, help="how many times to run each flag combination")
+    parser.add_argument("--timeout", type=float, default=0.5, help="the session timeout to give each run")
+    args = parser.parse_args()
+
+    print(f"{'first output (ms)':>18} {'exit (ms)':>10} {'peak RSS (KB)':>14} {'exit code':>10}  flags")
+    for flags, level_args in flag_combinations(args.manifest).items():
+        results = [ measure(args.chio, level_args, args.timeout) for _ in range(args.runs) ]
+        print(
+            f"{statistics.median(r[0] for r in results)*1000:18.1f} {statistics.median(r[1] for r in results)*1000:10.1f} "
+            f"{max(r[2] for r in results):14d} {results[-1][3]:10d}  {flags}"
+        )
+
+if __name__ == '__main__':
+    main()
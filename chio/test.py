@@ -6,9 +6,55 @@ import time
 import pwn
 import ast
 import os
+import json
+import socket
+import subprocess
+import random
+import importlib.util
+import zipfile
 
 CHAL = os.path.join(os.path.dirname(os.path.realpath(__file__)), "chio.py")
 
+def load_chio():
+    spec = importlib.util.spec_from_file_location("chio", CHAL)
+    chio = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(chio)
+    return chio
+
+def test_startup_partners():
+    chio = load_chio()
+    for argv in ([ "--check_stdout_pipe", "cat" ], [ "--check_stdout_pipe=cat" ], [ "--check_stdin_par" ], [ "--chio_level", "level-1" ], [ "--chio_level=level-1" ]):
+        assert chio.wants_startup_partners(argv)
+    for argv in ([ "--check_arg", "1:hello" ], [ "--", "--check_stdout_pipe" ], [ "--password", "x" ]):
+        assert not chio.wants_startup_partners(argv)
+
+    # a partner that is running when chio starts up, but is gone (and reaped) by the time the checks run, still counts.
+    # the driver holds the cat on a fifo until chio has been imported (and has taken its snapshot), then lets it finish.
+    if os.path.exists("/tmp/partner-fifo"):
+        os.unlink("/tmp/partner-fifo")
+    os.mkfifo("/tmp/partner-fifo")
+    driver = f"""if True:
+        import importlib.util, os, subprocess, sys, time
+        cat = subprocess.Popen([ "cat", "/tmp/partner-fifo" ], stdout=subprocess.PIPE)
+        os.dup2(cat.stdout.fileno(), 0)
+        cat.stdout.close()
+        while os.path.basename(os.readlink(f"/proc/{{cat.pid}}/exe")) != "cat":
+            time.sleep(0.01)
+
+        sys.argv = [ {CHAL!r}, "--check_stdin_pipe", "cat" ]
+        spec = importlib.util.spec_from_file_location("chio", {CHAL!r})
+        chio = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(chio)
+
+        with open("/tmp/partner-fifo", "w") as f:
+            f.write("hello")
+        cat.wait()
+        chio.main()
+    """
+    result = subprocess.run([ "python3", "-c", driver ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+    assert b"Success!" in result.stdout, result.stdout.decode()
+    assert result.returncode == 0
+
 def test_parents():
     # test python
     with open("/tmp/x.py", "w") as o:
@@ -98,6 +144,71 @@ def test_networking():
         p.readuntil("TCP port")
         assert b"Success!" not in pwn.process("""echo 'exec 3</dev/tcp/localhost/1337; while read -u 3 lol; do echo $lol; done' | bash -i""", shell=True).readall()
 
+def test_listen_sessions():
+    with pwn.process(f"{CHAL} --listen_dup 1338 --password hello".split()) as p:
+        p.readuntil("communicate on TCP port")
+        with pwn.remote("localhost", 1338) as r:
+            r.sendline(b"nope")
+            assert b"Success!" not in r.readall()
+        p.readall()
+        assert p.poll(block=True) == 2
+
+    with pwn.process(f"{CHAL} --listen_dup 1338 --chio_listen_sessions 4 --password hello".split()) as p:
+        p.readuntil("communicate on TCP port")
+        pwn.remote("localhost", 1338).close()
+        with pwn.remote("localhost", 1338) as r:
+            r.sendline(b"nope")
+            assert b"Success!" not in r.readall()
+        with pwn.remote("localhost", 1338) as r:
+            r.sendline(b"hello")
+            assert b"Success!" in r.readall()
+        p.readall()
+        assert p.poll(block=True) == 0
+
+    # without pidfds (here, because the fd limit is below where they go), only the first connection is checked
+    with pwn.process(f"ulimit -n 200; exec {CHAL} --listen_dup 1338 --chio_listen_sessions 4 --password hello", shell=True) as p:
+        p.readuntil("communicate on TCP port")
+        with pwn.remote("localhost", 1338) as r:
+            r.sendline(b"nope")
+            assert b"Success!" not in r.readall()
+        assert b"Traceback" not in p.readall()
+        assert p.poll(block=True) == 2
+
+def test_listen_activation():
+    with pwn.process(f"{CHAL} --listen_dup 0 --chio_port_fd 3 --password hello 3>/tmp/port", shell=True) as p:
+        p.readuntil("communicate on TCP port")
+        with open("/tmp/port") as f:
+            port = int(f.read())
+        with pwn.remote("localhost", port) as r:
+            r.sendline(b"hello")
+            assert b"Success!" in r.readall()
+
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        s.listen()
+        with subprocess.Popen(
+            f"export LISTEN_PID=$$ LISTEN_FDS=1; exec {CHAL} --listen_dup 1 --password hello 3<&{s.fileno()}",
+            shell=True, executable="/bin/bash", pass_fds=[ s.fileno() ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        ) as p:
+            with pwn.remote("localhost", s.getsockname()[1]) as r:
+                r.sendline(b"hello")
+                assert b"Success!" in r.readall()
+            assert b"LISTEN_FDS" in p.stdout.read()
+
+    # a listening unix socket is refused, rather than crashing on its path
+    with socket.socket(socket.AF_UNIX) as s:
+        if os.path.exists("/tmp/chio-listen.sock"):
+            os.unlink("/tmp/chio-listen.sock")
+        s.bind("/tmp/chio-listen.sock")
+        s.listen()
+        with subprocess.Popen(
+            f"export LISTEN_PID=$$ LISTEN_FDS=1; exec {CHAL} --listen_dup 1 --password hello 3<&{s.fileno()}",
+            shell=True, executable="/bin/bash", pass_fds=[ s.fileno() ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        ) as p:
+            output = p.stdout.read()
+            assert b"is not a listening TCP socket" in output and b"Traceback" not in output
+            assert p.wait() == 1
+
 def test_pipes():
     with pwn.process(f"/bin/cat /etc/passwd - | {CHAL} --check_stdin_pipe cat", shell=True) as p:
         assert b'Success!' in p.readuntil("Success!")
@@ -172,6 +283,35 @@ def test_challenges():
         solve_chals(p, 10)
         assert b"Success!" in p.readall()
 
+    with pwn.process(f"{CHAL} --num_challenges 100 --challenge_depth 5 --challenge_ops +*&^%| --challenge_batch 50".split()) as p:
+        for _ in range(2):
+            responses = [ ]
+            for _ in range(50):
+                p.readuntil("solution for: ")
+                responses.append(str(asteval.Interpreter()(p.readline().strip().decode())).encode())
+            p.send(b"\n".join(responses) + b"\n")
+        assert b"Success!" in p.readall()
+
+    if os.path.exists("/tmp/bank"):
+        os.unlink("/tmp/bank")
+    pwn.process(f"{CHAL} --build_challenge_bank --challenge_bank /tmp/bank --challenge_ops +*&^%| --challenge_depth 5 --challenge_bank_size 100".split()).readall()
+    with pwn.process(f"{CHAL} --num_challenges 10 --challenge_depth 5 --challenge_ops +*&^%| --challenge_bank /tmp/bank".split()) as p:
+        solve_chals(p, 10)
+        assert b"Success!" in p.readall()
+
+    # an empty bank would leave nothing to draw from
+    with pwn.process(f"{CHAL} --build_challenge_bank --challenge_bank /tmp/bank --challenge_ops +* --challenge_depth 5 --challenge_bank_size 0".split()) as p:
+        assert b"must be at least 1" in p.readall()
+        assert p.poll(block=True) != 0
+
+    # and so would an empty section, so those are generated instead
+    chio = load_chio()
+    bank = chio.load_challenge_bank("/tmp/bank")
+    chio.write_challenge_bank("/tmp/bank", { key: [ ] for key in bank })
+    with pwn.process(f"{CHAL} --num_challenges 10 --challenge_depth 5 --challenge_ops +*&^%| --challenge_bank /tmp/bank".split()) as p:
+        solve_chals(p, 10)
+        assert b"Success!" in p.readall()
+
     with pwn.process(f"{CHAL} --password asdf", shell=True) as p:
         p.sendline(b"asdf")
         assert b"Success!" in p.readall()
@@ -189,6 +329,57 @@ def test_challenges():
         p.sendline("asdf")
         assert b"Success!" not in p.readall()
 
+def test_timeouts():
+    with pwn.process(f"{CHAL} --password asdf --chio_step_timeout 0.5".split()) as p:
+        assert b"took too long" in p.readall()
+        assert p.poll(block=True) == 3
+
+    with pwn.process(f"{CHAL} --num_signals 10 --chio_session_timeout 0.5".split()) as p:
+        assert b"took too long" in p.readall()
+        assert p.poll(block=True) == 3
+
+def test_challenge_generation():
+    chio = load_chio()
+    for ops in [ "+*", "+*%", "+*&^%|", "%", "/&" ]:
+        for seed in range(100):
+            myrand = random.Random(seed)
+            challenge, solution = chio.generate_challenge(ops, myrand.randrange(10), myrand)
+            assert str(asteval.Interpreter()(challenge)) == str(solution)
+
+def test_schedule():
+    # the cheap, failing check_env runs first, and the pipe scan never starts
+    result = subprocess.run(
+        [ "bash", "-c", f"{CHAL} --check_stdout_pipe cat --check_env asdf:fdsa --chio_schedule cost --chio_profile 3 3>/tmp/profile 2>&1 | cat; exit ${{PIPESTATUS[0]}}" ],
+        env={ "asdf": "nope" }, stdout=subprocess.PIPE, check=False
+    )
+    assert result.returncode == 2
+    assert b"Specifically, you must fix the following issue:" in result.stdout
+    assert b"The value of environment variable asdf is not 'fdsa'" in result.stdout
+    assert b"stdout_pipe" not in result.stdout
+    with open("/tmp/profile") as f:
+        steps = [ line.split()[1] for line in f if line.startswith("[PROFILE]") and ":" not in line ]
+    assert steps == [ "step", "startup", "check_env" ]
+
+    # the checks run concurrently, but they are reported exactly as if they had run one after the other
+    expected = [
+        "[TEST] You should have redirected my stdout to another process. Checking...",
+        "[TEST] Performing checks on that process!",
+        "[PASS] You have passed the checks on the process on the other end of my stdout!",
+        "[TEST] You should launch me with a working directory of /tmp.",
+        "[PASS] Looks like my working directory is correct!",
+        "[TEST] My argv[1] should have a value of hello! Let's check...",
+        "[PASS] You successfully passed the argument value check!",
+        "[TEST] My 'asdf' environment variable should have a value of fdsa! Let's check...",
+        "[PASS] You successfully passed the environment value check!",
+        "[PASS] Success! You have satisfied all execution requirements.",
+    ]
+    for _ in range(3):
+        output = subprocess.run(
+            f"{CHAL} --check_stdout_pipe cat --cwd /tmp --check_arg 1:hello --check_env asdf:fdsa -- x hello 2>&1 | cat",
+            shell=True, cwd="/tmp", env={ "asdf": "fdsa" }, stdout=subprocess.PIPE, check=True
+        ).stdout.decode()
+        assert [ line for line in output.splitlines() if line.startswith(("[TEST]", "[PASS]")) ] == expected
+
 def test_signals():
     with pwn.process(f"{CHAL} --num_signals 10".split()) as p:
         p.readuntil("order: ")
@@ -210,16 +401,218 @@ def test_signals():
             p.clean()
         assert b"Success!" not in p.readall()
 
+def test_scan_scopes():
+    chio = load_chio()
+    assert chio.read_scope_key(os.getpid(), "uid") == str(os.getuid())
+    for scope in ("all", "pidns", "cgroup", "uid"):
+        assert b'Success!' in pwn.process(f"{CHAL} --check_stdout_pipe cat --chio_scan_scope {scope} | cat", shell=True).readall()
+        with socket.socket() as s:
+            s.bind(("localhost", 0))
+            port = s.getsockname()[1]
+        with open("/tmp/scope-client.py", "w") as o:
+            o.write(f"import socket, sys\nsys.stdout.buffer.write(socket.create_connection(('localhost', {port})).makefile('rb').read())\n")
+        with pwn.process(f"{CHAL} --listen_dup {port} --client python --chio_scan_scope {scope}".split()) as p:
+            p.readuntil("communicate on TCP port")
+            assert b'Success!' in pwn.process("python3 /tmp/scope-client.py".split()).readall()
+
+def test_binary_cache():
+    chio = load_chio()
+    for name,source in (("without", "int main() { return 0; }"), ("other", "int main() { return 1; }")):
+        subprocess.run(f"gcc -x c -o /tmp/cache-{name} -".split(), input=source.encode(), check=True)
+    cache = "/tmp/chio-binary-cache"
+    if os.path.exists(cache):
+        os.unlink(cache)
+    with open("/tmp/cache-without", "rb") as f:
+        binary = f.read()
+    with open("/tmp/cache-binary", "wb") as f:
+        f.write(binary)
+    assert chio.cached_inspect_elf("/tmp/cache-binary", b"pwncollege", cache, 8) == (True, False)
+
+    # a hit is answered from the cache alone, so a doctored entry shows through
+    with open(cache) as f:
+        entries = json.load(f)
+    for entry in entries.values():
+        entry["has_symbol"] = True
+    with open(cache, "w") as f:
+        json.dump(entries, f)
+    assert chio.cached_inspect_elf("/tmp/cache-binary", b"pwncollege", cache, 8) == (True, True)
+
+    # a binary rewritten in place (with its mtime restored) must miss
+    st = os.stat("/tmp/cache-binary")
+    with open("/tmp/cache-other", "rb") as f, open("/tmp/cache-binary", "r+b") as o:
+        o.write(f.read())
+        o.truncate()
+    os.utime("/tmp/cache-binary", ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert chio.cached_inspect_elf("/tmp/cache-binary", b"pwncollege", cache, 8) == (True, False)
+
+    # a deleted binary fails the check instead of crashing it
+    os.unlink("/tmp/cache-binary")
+    assert chio.cached_inspect_elf("/tmp/cache-binary (deleted)", b"pwncollege", cache, 8) == (False, False)
+
+def test_levels():
+    chio = load_chio()
+    for level in chio.load_manifest(chio.DEFAULT_MANIFEST)["levels"]:
+        chio.load_level(chio.DEFAULT_MANIFEST, level)
+
+    with open("/tmp/levels.json", "w") as f:
+        json.dump({ "chio": CHAL, "levels": {
+            "level-arg": { "args": [ "--check_arg", "1:hello", "--password", "asdf" ], "plan": [ "check_arg", "password" ], "variants": 2 },
+            "level-same": { "args": [ "--check_arg", "1:hello", "--password", "asdf" ], "plan": [ "check_arg", "password" ], "variants": 1 },
+        } }, f)
+    pwn.process(f"{CHAL} --chio_manifest /tmp/levels.json --build_launchers /tmp/launchers".split()).readall()
+    assert os.readlink("/tmp/launchers/level-arg/_1/run") == "../run"
+    assert os.readlink("/tmp/launchers/level-same/run") == "../level-arg/run"
+    assert os.readlink("/tmp/launchers/level-arg/_1/chio.py") == "../../chio.pyz"
+    assert b"Success!" in pwn.process("/tmp/launchers/level-same/_0/chio.py --check_arg 1:hello -- x hello".split()).readall()
+    with open("/tmp/launchers/level-arg/run", "rb") as f:
+        assert not chio.elf_needed_versions(f.read())
+    with pwn.process([ "/tmp/launchers/level-arg/_1/run", "hello" ]) as p:
+        p.sendline(b"asdf")
+        assert b"Success!" in p.readall()
+
+    with pwn.process(f"{CHAL} --chio_manifest /tmp/levels.json --chio_level level-arg --password nope -- x hello".split()) as p:
+        p.sendline(b"nope")
+        assert b"Success!" in p.readall()
+
+def test_zipapp():
+    pwn.process(f"{CHAL} --build_zipapp /tmp/chio.pyz".split()).readall()
+    assert b"Success!" in pwn.process("/tmp/chio.pyz --check_arg 1:hello -- x hello".split()).readall()
+    with pwn.process("/tmp/chio.pyz --check_arg 1:hello -- x nope".split()) as p:
+        assert b"Success!" not in p.readall()
+        assert p.poll(block=True) == 2
+
+    # the deployed zipapp is rebuilt (by --build_launchers) whenever chio.py changes
+    with zipfile.ZipFile(os.path.join(os.path.dirname(os.path.dirname(CHAL)), "program-interaction", "chio.pyz")) as z, open(CHAL, "rb") as f:
+        assert z.read("chio.py") == f.read(), "program-interaction/chio.pyz is stale; rerun chio.py --build_launchers"
+
+def test_jsonl():
+    with pwn.process(f"{CHAL} --check_arg 1:hello --password asdf --chio_format jsonl -- x hello".split()) as p:
+        p.sendline(b"asdf")
+        records = [ json.loads(line) for line in p.readall().splitlines() ]
+    assert { r["type"] for r in records } >= { "info", "test", "pass" }
+    assert records[-1] == { "type": "pass", "message": "Success! You have satisfied all execution requirements." }
+
+def test_traceback_order():
+    # a crash's traceback comes after everything printed before it, as it did before output was buffered
+    output = pwn.process(f"{CHAL} --reward /nonexistent".split()).readall()
+    assert output.index(b"Success!") < output.index(b"Here is your flag:") < output.index(b"Traceback")
+
+def test_profile():
+    with pwn.process(f"{CHAL} --check_stdin_pipe cat --chio_format jsonl --chio_profile 1".split() + [ "--chio_fail_fd", "-1" ], stdin=pwn.PIPE) as p:
+        profile = json.loads(p.readall().splitlines()[-1])
+    assert profile["type"] == "profile"
+    assert [ s["name"] for s in profile["steps"] ] == [ "startup", "pipe_partners", "stdin_pipe" ]
+    assert profile["counts"]["proc_reads"] > 0
+
+def test_stats():
+    for path in ("/tmp/chio-stats", "/tmp/chio-stats.rollup", "/tmp/chio-stats.prom"):
+        if os.path.exists(path):
+            os.unlink(path)
+    # the student controls the umask, but must not get a stats file they can write to
+    umask = os.umask(0)
+    for password in ("asdf", "nope"):
+        with pwn.process(f"{CHAL} --password asdf --chio_stats /tmp/chio-stats".split()) as p:
+            p.sendline(password.encode())
+            p.readall()
+    os.umask(umask)
+    assert os.stat("/tmp/chio-stats").st_mode & 0o777 == 0o644
+    with open("/tmp/chio-stats") as f:
+        records = [ json.loads(line) for line in f ]
+    assert [ r["exit"] for r in records ] == [ 0, 2 ]
+    assert [ c[:2] for c in records[1]["checks"] ] == [ [ "startup", "ok" ], [ "password", "fail" ] ]
+
+    # records that are valid JSON, but not valid records, are skipped rather than crashing every rollup
+    with open("/tmp/chio-stats", "a") as f:
+        f.write('{}\n{"level":null,"flags":"","checks":[["x"]],"duration":1,"exit":0}\nnope\n')
+    assert b"Skipped 3 malformed records." in pwn.process(f"{CHAL} --chio_stats /tmp/chio-stats --chio_stats_rollup /tmp/chio-stats.prom".split()).readall()
+    with open("/tmp/chio-stats.prom") as f:
+        prom = f.read()
+    assert 'chio_check_duration_seconds_count{level="--password",step="password",outcome="fail"} 1' in prom
+    assert 'chio_attempt_duration_seconds_count{level="--password",exit="0"} 1' in prom
+
+def test_service():
+    levels = {
+        "env": [ "--check_env", "asdf:fdsa" ],
+        "password": [ "--password", "hello" ],
+        "listen": [ "--listen_dup", "1339", "--chio_listen_sessions", "2", "--password", "hello" ],
+        "signals": [ "--num_signals", "5" ],
+        "input": [ "--input_dup", "302", "--password", "hello" ],
+    }
+    chio = load_chio()
+    with open("/tmp/service-levels.json", "w") as f:
+        json.dump({ "chio": CHAL, "levels": {
+            level: { "args": args, "plan": [ name for name,_,_ in chio.plan_checks(chio.build_parser().parse_args(args)) ], "variants": 1 }
+            for level,args in levels.items()
+        } }, f)
+    launcher = os.path.join(os.path.dirname(CHAL), "launcher.c")
+    for level in levels:
+        subprocess.run([ "gcc", "-DCHIO_SOCKET=\"/tmp/chio.sock\"", f"-DCHIO_LEVEL=\"{level}\"", "-o", f"/tmp/chio-launcher-{level}", launcher ], check=True)
+
+    with pwn.process(f"{CHAL} --chio_serve /tmp/chio.sock --chio_manifest /tmp/service-levels.json".split()) as service:
+        service.readuntil("Serving")
+
+        assert b"Success!" in pwn.process("/tmp/chio-launcher-env", env={"asdf": "fdsa"}).readall()
+        with pwn.process("/tmp/chio-launcher-env", env={"asdf": "nope"}) as p:
+            assert b"Success!" not in p.readall()
+            assert p.poll(block=True) == 2
+
+        # the launcher's own arguments are only ever the student's argv, and can't add checks or a reward
+        with pwn.process("/tmp/chio-launcher-password --reward /etc/hostname --chio_stats /tmp/nope".split()) as p:
+            p.sendline(b"hello")
+            output = p.readall()
+            assert b"Success!" in output and b"[FLAG]" not in output
+            assert p.poll(block=True) == 0
+        assert not os.path.exists("/tmp/nope")
+
+        with subprocess.Popen("echo hello > /tmp/service-input; exec /tmp/chio-launcher-input 302</tmp/service-input", shell=True, executable="/bin/bash", stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as p:
+            assert b"Success!" in p.stdout.read()
+            assert p.wait() == 0
+
+        with pwn.process("/tmp/chio-launcher-listen") as p:
+            p.readuntil("communicate on TCP port")
+            with pwn.remote("localhost", 1339) as r:
+                r.sendline(b"nope")
+                assert b"Success!" not in r.readall()
+            with pwn.remote("localhost", 1339) as r:
+                r.sendline(b"hello")
+                assert b"Success!" in r.readall()
+            p.readall()
+            assert p.poll(block=True) == 0
+
+        with pwn.process("/tmp/chio-launcher-signals") as p:
+            p.readuntil("order: ")
+            signal_list = ast.literal_eval(p.readline().strip().decode('latin1'))
+            for s in signal_list:
+                p.clean()
+                time.sleep(0.1)
+                os.kill(p.pid, getattr(signal, s))
+            assert b"Success!" in p.readall()
+
 if __name__ == '__main__':
     test_pipes()
     test_parents()
+    test_startup_partners()
     test_challenges()
+    test_challenge_generation()
+    test_timeouts()
+    test_schedule()
     test_signals()
+    test_service()
+    test_scan_scopes()
+    test_binary_cache()
+    test_levels()
+    test_zipapp()
+    test_jsonl()
+    test_traceback_order()
+    test_profile()
+    test_stats()
     test_arg()
     test_cwd()
     test_fifo()
     test_env()
     test_redirection()
     test_networking()
+    test_listen_sessions()
+    test_listen_activation()
 
     print("SUCCESS")
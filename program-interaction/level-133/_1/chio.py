@@ -1 +1 @@
-../../../chio/chio.py
\ No newline at end of file
+../../chio.pyz
\ No newline at end of file